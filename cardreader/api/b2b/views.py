@@ -5,6 +5,8 @@ from rest_framework.response import Response
 from rest_framework_api_key.models import APIKey
 from rest_framework_api_key.permissions import HasAPIKey
 
+from cardreader.api.idempotency import idempotent
+from cardreader.api.upload_handlers import card_upload_handlers
 from cardreader.api.b2b.serializers import CompanySerializer, B2BIdCardSerializer, B2BHealthCareCardSerializer, \
     B2BStudentCardSerializer
 from cardreader.api.serializers import IdCardSerializer, HealthCareCardSerializer, StudentCardSerializer
@@ -41,6 +43,8 @@ def create_company(request):
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 @permission_classes([HasAPIKey])
+@idempotent
+@card_upload_handlers
 def read_id_card(request):
     key = request.headers.get("Authorization").split()[1]
     # Get the APIKey instance
@@ -61,6 +65,8 @@ def read_id_card(request):
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 @permission_classes([HasAPIKey])
+@idempotent
+@card_upload_handlers
 def read_healthcare_card(request):
     key = request.headers.get("Authorization").split()[1]
     # Get the APIKey instance
@@ -80,6 +86,8 @@ def read_healthcare_card(request):
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 @permission_classes([HasAPIKey])
+@idempotent
+@card_upload_handlers
 def read_student_card(request):
     key = request.headers.get("Authorization").split()[1]
     # Get the APIKey instance
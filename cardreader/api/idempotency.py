@@ -0,0 +1,92 @@
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from cardreader.models import IdempotencyRecord
+
+
+def idempotent(view):
+    """
+    Honours the Idempotency-Key header on POST requests.
+
+    The first request with a key reserves it and runs the view. A retry that arrives while the
+    first one is still running waits for it, and gets a 409 if it does not finish in time.
+    Once the view has answered, retries within the retention window get the stored response
+    replayed without running the view again. A reservation whose request never answered, e.g.
+    because its worker was killed, is released after IDEMPOTENCY_LEASE seconds.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or not key:
+            return view(request, *args, **kwargs)
+
+        scope = _scope(request)
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            record, created = _reserve(scope, key, request.path)
+            if created:
+                break
+            if record.requestPath != request.path:
+                return Response({'error': 'Idempotency-Key was already used for a different endpoint'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = _wait_for_completion(record, deadline)
+            if record is None:
+                # The first request failed and released the key, the waiting retries compete for it again
+                continue
+            if record.status != 'completed':
+                return Response({'error': 'A request with this Idempotency-Key is still being processed'},
+                                status=status.HTTP_409_CONFLICT)
+            return Response(record.responseBody, status=record.responseStatus,
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            # Server errors are not remembered so the client can retry them
+            record.delete()
+        else:
+            # The row is gone if the request outlived its lease
+            IdempotencyRecord.objects.filter(pk=record.pk).update(
+                status='completed', responseStatus=response.status_code, responseBody=response.data)
+        return response
+
+    return wrapper
+
+
+def _scope(request):
+    if request.user and request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    # B2B clients are anonymous and identified by their API key
+    credentials = request.headers.get('Authorization', '')
+    return 'key:' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def _reserve(scope, key, path):
+    now = timezone.now()
+    IdempotencyRecord.objects.filter(
+        Q(createdAt__lt=now - timedelta(seconds=settings.IDEMPOTENCY_RETENTION))
+        | Q(status='in_progress', createdAt__lt=now - timedelta(seconds=settings.IDEMPOTENCY_LEASE))
+    ).delete()
+    return IdempotencyRecord.objects.get_or_create(scope=scope, key=key, defaults={'requestPath': path})
+
+
+def _wait_for_completion(record, deadline):
+    while record.status != 'completed' and time.monotonic() < deadline:
+        time.sleep(0.2)
+        record = IdempotencyRecord.objects.filter(pk=record.pk).first()
+        if record is None:
+            # The first request failed and released the key
+            return None
+    return record
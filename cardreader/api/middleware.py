@@ -0,0 +1,26 @@
+import re
+
+from cardreader.services.tracing_service import span, new_request_id
+
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestTracingMiddleware:
+    """
+    Opens the root span of every request. A well-formed X-Request-ID header sent by the client
+    is used as the request id, otherwise a new one is generated; either way it is echoed back.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = new_request_id()
+
+        with span('http.request', request_id=request_id, method=request.method, path=request.path) as current:
+            response = self.get_response(request)
+            current.set_attribute('status', response.status_code)
+        response['X-Request-ID'] = request_id
+        return response
@@ -0,0 +1,18 @@
+import hmac
+
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+
+class HasMetricsToken(BasePermission):
+    """
+    Allows requests that send METRICS_TOKEN as their bearer token, e.g. the Prometheus scraper.
+    Every request is denied while no token is configured.
+    """
+
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if not token or scheme.lower() != 'bearer':
+            return False
+        return hmac.compare_digest(credentials.strip().encode(), token.encode())
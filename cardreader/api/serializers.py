@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from cardreader.models import User, IdCard, HealthCareCard, StudentCard, Group, Invitation
+from cardreader.models import User, IdCard, HealthCareCard, StudentCard, Group, Invitation, CardIngestionJob
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -62,6 +62,23 @@ class StudentCardSerializer(serializers.ModelSerializer):
         return request.build_absolute_uri(obj.imageBack.url) if obj.imageBack else None
 
 
+class CardIngestionJobSerializer(serializers.ModelSerializer):
+    card = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CardIngestionJob
+        fields = ['id', 'cardType', 'status', 'error', 'createdAt', 'updatedAt', 'card']
+
+    def get_card(self, obj):
+        if obj.idCard:
+            return IdCardSerializer(obj.idCard, context=self.context).data
+        if obj.studentCard:
+            return StudentCardSerializer(obj.studentCard, context=self.context).data
+        if obj.healthCareCard:
+            return HealthCareCardSerializer(obj.healthCareCard, context=self.context).data
+        return None
+
+
 class GroupListSerializer(serializers.ModelSerializer):
     createdBy = UserSerializer()
     users = UserSerializer(many=True)
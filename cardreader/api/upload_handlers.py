@@ -0,0 +1,32 @@
+import functools
+
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class CardMemoryUploadHandler(MemoryFileUploadHandler):
+    """
+    Keeps a card upload in memory only while the whole request stays below
+    CARD_UPLOAD_MEMORY_LIMIT, larger ones fall through to the temporary file handler.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.activated = content_length <= settings.CARD_UPLOAD_MEMORY_LIMIT
+
+
+def card_upload_handlers(view):
+    """
+    Streams large card image uploads of a POST to a temporary file instead of memory,
+    so they can later be decoded from a memory-mapped view of that file.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method == 'POST':
+            django_request = request._request
+            django_request.upload_handlers = [
+                CardMemoryUploadHandler(django_request),
+                TemporaryFileUploadHandler(django_request),
+            ]
+        return view(request, *args, **kwargs)
+
+    return wrapper
@@ -23,6 +23,8 @@ urlpatterns = [
     path('studentcard/<int:id>/', views.student_card_view, name='student_cards'),
     path('studentcard/<int:id>/<int:group_id>/', views.student_card_view, name='student_cards'),
     path('studentcard/base64/', views.add_student_card_base64, name='student_cards_base64'),
+    path('jobs/<int:id>/', views.card_job_view, name='card_job'),
+    path('metrics/', views.metrics_view, name='metrics'),
     path('groups/', views.group_view, name='create_group'),
     path('groups/<int:id>/', views.group_view, name='get_group'),
     path('groups/add_cards/<int:group_id>/', views.add_cards_to_group, name='add-cards-to-group'),
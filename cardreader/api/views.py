@@ -1,20 +1,23 @@
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view, permission_classes, parser_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes, authentication_classes
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
-from torch.distributed import group
 
 from .serializers import UserSerializer, IdCardSerializer, HealthCareCardSerializer, StudentCardSerializer, \
-    GroupListSerializer, GroupCreateSerializer, GroupDetailSerializer, InvitationSerializer, AddCardsSerializer
-from cardreader.models import IdCard, StudentCard, HealthCareCard, Group, Invitation
+    GroupListSerializer, GroupCreateSerializer, GroupDetailSerializer, InvitationSerializer, AddCardsSerializer, \
+    CardIngestionJobSerializer
+from cardreader.models import IdCard, StudentCard, HealthCareCard, Group, Invitation, CardIngestionJob
 from rest_framework import status
 
+from .idempotency import idempotent
+from .permissions import HasMetricsToken
+from .upload_handlers import card_upload_handlers
 from ..services.converter_service import ConverterService
-from ..services.healthcarecard_reader_service import HealthCareCardReaderService
-from ..services.idcard_reader_service import IdCardReaderService
-from ..services.studentcard_reader_service import StudentCardReaderService
+from ..services.ingestion_job_service import IngestionJobService
+from ..services.metrics_service import registry
 from ..services.user_service import UserService
 
 
@@ -43,6 +46,8 @@ def signup(request):
 @api_view(['POST', 'GET', 'PUT', 'DELETE'])
 @parser_classes([MultiPartParser, FormParser, JSONParser])
 @permission_classes([IsAuthenticated])
+@idempotent
+@card_upload_handlers
 def healthcare_card_view(request, id=None, group_id = None):
     user = request.user
 
@@ -53,10 +58,9 @@ def healthcare_card_view(request, id=None, group_id = None):
 
     elif request.method == 'POST':
         image_front = request.FILES['imageFront']
-        service = HealthCareCardReaderService(image_front, user)
-        card = service.read_data()
-        card.save()
-        return Response({'message': 'Healthcare card added successfully'}, status=201)
+        job = IngestionJobService().submit('healthcard', user, image_front)
+        return Response({'message': 'Healthcare card queued for processing', 'jobId': job.id, 'status': job.status},
+                        status=status.HTTP_202_ACCEPTED)
 
     elif request.method == 'PUT' and id:
         card = get_object_or_404(HealthCareCard, id=id, user=user)
@@ -85,6 +89,8 @@ def healthcare_card_view(request, id=None, group_id = None):
 @api_view(['POST', 'GET', 'PUT', 'DELETE'])
 @parser_classes([MultiPartParser, FormParser, JSONParser])
 @permission_classes([IsAuthenticated])
+@idempotent
+@card_upload_handlers
 def student_card_view(request, id=None, group_id = None):
     user = request.user
     if request.method == "GET":
@@ -95,13 +101,9 @@ def student_card_view(request, id=None, group_id = None):
     elif request.method == "POST":
         image_front = request.FILES['imageFront']
         image_back = request.FILES['imageBack']
-
-
-        service = StudentCardReaderService(image_front,image_back, user)
-
-        card = service.read_data()
-        card.save()
-        return Response({'message': 'Student card added successfully'}, status=201)
+        job = IngestionJobService().submit('studentcard', user, image_front, image_back)
+        return Response({'message': 'Student card queued for processing', 'jobId': job.id, 'status': job.status},
+                        status=status.HTTP_202_ACCEPTED)
 
     elif request.method == 'PUT' and id:
         card = get_object_or_404(StudentCard, id=id, user=user)
@@ -131,17 +133,17 @@ def student_card_view(request, id=None, group_id = None):
 @api_view(['GET', 'POST', 'DELETE', 'PUT'])
 @parser_classes([MultiPartParser, FormParser, JSONParser])
 @permission_classes([IsAuthenticated])
+@idempotent
+@card_upload_handlers
 def idcard_view(request, id=None, group_id = None):
     user = request.user
 
     if request.method == 'POST':
         image_front = request.FILES['imageFront']
         image_back = request.FILES['imageBack']
-        service = IdCardReaderService(image_front, image_back, user)
-        card = service.read_data()
-        card.save()
-
-        return Response({'message': 'ID card added successfully'}, status=201)
+        job = IngestionJobService().submit('idcard', user, image_front, image_back)
+        return Response({'message': 'ID card queued for processing', 'jobId': job.id, 'status': job.status},
+                        status=status.HTTP_202_ACCEPTED)
 
     elif request.method == 'GET':
         # Handle retrieving the ID cards for the user
@@ -152,7 +154,6 @@ def idcard_view(request, id=None, group_id = None):
     elif request.method == 'PUT' and id:
         card = get_object_or_404(IdCard, id=id, user=user)
         serializer = IdCardSerializer(card, data=request.data, partial=True, context={'request': request})
-        print(serializer.initial_data)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -176,35 +177,50 @@ def idcard_view(request, id=None, group_id = None):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def add_idcard_base64(request):
     converter_service = ConverterService()
     image_front = converter_service.base64_to_file(request.data['imageFront'])
     image_back = converter_service.base64_to_file(request.data['imageBack'])
-    service = IdCardReaderService(image_front, image_back, request.user)
-    card = service.read_data()
-    card.save()
-    return Response({'message': 'ID card added successfully'}, status=201)
+    job = IngestionJobService().submit('idcard', request.user, image_front, image_back)
+    return Response({'message': 'ID card queued for processing', 'jobId': job.id, 'status': job.status},
+                    status=status.HTTP_202_ACCEPTED)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def add_healthcare_card_base64(request):
     converter_service = ConverterService()
     image_front = converter_service.base64_to_file(request.data['imageFront'])
-    service = HealthCareCardReaderService(image_front, request.user)
-    card = service.read_data()
-    card.save()
-    return Response({'message': 'Healthcare card added succesfuly'}, status=201)
+    job = IngestionJobService().submit('healthcard', request.user, image_front)
+    return Response({'message': 'Healthcare card queued for processing', 'jobId': job.id, 'status': job.status},
+                    status=status.HTTP_202_ACCEPTED)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def add_student_card_base64(request):
     converter_service = ConverterService()
     image_front = converter_service.base64_to_file(request.data['imageFront'])
     image_back = converter_service.base64_to_file(request.data['imageBack'])
-    service = StudentCardReaderService(image_front, image_back, request.user)
-    card = service.read_data()
-    card.save()
-    return Response({'message': 'Student ID card added successfully'}, status=201)
+    job = IngestionJobService().submit('studentcard', request.user, image_front, image_back)
+    return Response({'message': 'Student ID card queued for processing', 'jobId': job.id, 'status': job.status},
+                    status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def card_job_view(request, id):
+    job = get_object_or_404(CardIngestionJob, id=id, user=request.user)
+    serializer = CardIngestionJobSerializer(job, context={'request': request})
+    return Response(serializer.data)
+
+@api_view(['GET'])
+# The scraper's bearer token is not a JWT
+@authentication_classes([])
+@permission_classes([HasMetricsToken])
+def metrics_view(request):
+    # Prometheus text exposition format, summed over the web and job worker processes
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @api_view(['POST', 'GET'])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,115 @@
+import difflib
+import json
+import os
+import statistics
+import time
+
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cardreader.services import onnx_backend_service
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+
+
+class Command(BaseCommand):
+    help = ('Runs the same images through the torch and the ONNX OCR backends and compares latency, '
+            'agreement with the torch output and, given labels, accuracy')
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', help='Directory of field crops or whole card images')
+        parser.add_argument('--labels', help='JSON file mapping image file names to their expected text')
+        parser.add_argument('--mode', choices=('detect', 'recognize'), default='recognize',
+                            help='detect runs text detection and recognition, recognize treats every image '
+                                 'as one text line like the recognizer-only field reads')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--onnx-dir', default=settings.OCR_ONNX_DIR)
+        parser.add_argument('--float', action='store_true', help='Compare the unquantized ONNX models')
+        parser.add_argument('--threads', type=int, default=settings.OCR_SERVER_THREADS,
+                            help='Intra-op threads of both backends, so they are compared on the same cores')
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        import torch
+        from easyocr import Reader
+
+        names = sorted(name for name in os.listdir(options['images']) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not names:
+            raise CommandError(f"No images in {options['images']}")
+        images = [cv2.imread(os.path.join(options['images'], name)) for name in names]
+        labels = {}
+        if options['labels']:
+            with open(options['labels'], encoding='utf-8') as file:
+                labels = json.load(file)
+
+        threads = max(1, options['threads'])
+        torch.set_num_threads(threads)
+        backends = {
+            'torch': Reader(['hu'], gpu=False),
+            'onnx': onnx_backend_service.install(Reader(['hu'], gpu=False), options['onnx_dir'],
+                                                 quantized=not options['float'], threads=(threads, 1)),
+        }
+        texts, timings = {}, {}
+        for backend, reader in backends.items():
+            self.__read(reader, images[0], options['mode'])  # warm-up
+            texts[backend], timings[backend] = [], []
+            for image in images:
+                durations = []
+                for _ in range(max(1, options['repeat'])):
+                    started = time.perf_counter()
+                    text = self.__read(reader, image, options['mode'])
+                    durations.append(time.perf_counter() - started)
+                texts[backend].append(text)
+                timings[backend].append(min(durations))
+
+        report = {'images': len(images), 'mode': options['mode'], 'repeat': options['repeat'],
+                  'threads': threads, 'quantized': not options['float'], 'backends': {}}
+        self.stdout.write(f'{len(images)} images, {options["mode"]} mode, {threads} thread(s), '
+                          f'best of {options["repeat"]} runs')
+        self.stdout.write(f'{"backend":<8} {"p50 ms":>8} {"p95 ms":>8} {"mean ms":>8} {"accuracy":>9} {"similarity":>11}')
+        for backend in backends:
+            durations = sorted(timings[backend])
+            p95 = durations[min(len(durations) - 1, int(round(0.95 * (len(durations) - 1))))]
+            accuracy, similarity = self.__score(names, texts[backend], labels)
+            report['backends'][backend] = {'p50_ms': statistics.median(durations) * 1000, 'p95_ms': p95 * 1000,
+                                           'mean_ms': statistics.mean(durations) * 1000,
+                                           'accuracy': accuracy, 'similarity': similarity}
+            self.stdout.write(f'{backend:<8} {statistics.median(durations) * 1000:>8.1f} {p95 * 1000:>8.1f} '
+                              f'{statistics.mean(durations) * 1000:>8.1f} {accuracy:>9} {similarity:>11}')
+
+        agreeing = sum(a == b for a, b in zip(texts['torch'], texts['onnx']))
+        agreement = statistics.mean(self.__similarity(a, b) for a, b in zip(texts['torch'], texts['onnx']))
+        report['identical'] = agreeing
+        report['agreement_similarity'] = agreement
+        report['differences'] = {name: {'torch': torch_text, 'onnx': onnx_text}
+                                 for name, torch_text, onnx_text in zip(names, texts['torch'], texts['onnx'])
+                                 if torch_text != onnx_text}
+        self.stdout.write(f'\nONNX output identical to torch on {agreeing}/{len(images)} images, '
+                          f'mean similarity {agreement:.3f}')
+        for name, difference in report['differences'].items():
+            self.stdout.write(f'  {name}: torch={difference["torch"]!r} onnx={difference["onnx"]!r}')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def __read(reader, image, mode):
+        if mode == 'detect':
+            return ' '.join(reader.readtext(image, detail=0))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        return ' '.join(reader.recognize(gray, horizontal_list=[[0, w, 0, h]], free_list=[], detail=0))
+
+    def __score(self, names, texts, labels):
+        pairs = [(labels[name], text) for name, text in zip(names, texts) if name in labels]
+        if not pairs:
+            return '-', '-'
+        accuracy = sum(expected == text for expected, text in pairs) / len(pairs)
+        similarity = statistics.mean(self.__similarity(expected, text) for expected, text in pairs)
+        return f'{accuracy:.3f}', f'{similarity:.3f}'
+
+    @staticmethod
+    def __similarity(a, b):
+        return difflib.SequenceMatcher(None, a, b).ratio()
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cardreader.services import onnx_backend_service
+
+
+class Command(BaseCommand):
+    help = 'Exports the easyocr CRAFT detector and recognizer to ONNX and quantizes them to int8 for OCR_BACKEND=onnx'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.OCR_ONNX_DIR)
+        parser.add_argument('--languages', default='hu')
+        parser.add_argument('--no-quantize', action='store_true')
+        parser.add_argument('--opset', type=int, default=17)
+
+    def handle(self, *args, **options):
+        from easyocr import Reader
+
+        # The float networks, torch's own dynamic quantization of the CPU reader can not be exported
+        reader = Reader(options['languages'].split(','), gpu=False, quantize=False)
+        paths = onnx_backend_service.export_models(reader, options['output'], quantize=not options['no_quantize'],
+                                                   opset=options['opset'])
+        for path in paths:
+            self.stdout.write(f'Wrote {path}')
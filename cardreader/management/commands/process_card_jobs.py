@@ -0,0 +1,106 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, close_old_connections
+
+from cardreader.services.ingestion_job_service import IngestionJobService
+from cardreader.services.metrics_service import registry
+from cardreader.services.preload_service import preload_models, after_fork
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the parent's checks for dead workers and stale jobs
+SUPERVISE_INTERVAL = 10
+
+
+def _interrupt(signum, frame):
+    # docker stop and systemd send SIGTERM, which unwinds the parent like Ctrl-C
+    raise KeyboardInterrupt
+
+
+def run_worker(poll_interval):
+    # A terminated worker dies on the spot, so its job stays 'processing' with its uploads and is requeued
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    after_fork()
+    service = IngestionJobService()
+    try:
+        while True:
+            # Drops connections the database closed while the worker was idle or restarting
+            close_old_connections()
+            try:
+                job = service.claim_next()
+                if job is not None:
+                    service.process(job)
+            except Exception:
+                logger.exception("Card job worker iteration failed")
+                job = None
+            registry.dump()
+            if job is None:
+                # Picks up what the image writer threads recorded after the last job
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Processes queued card ingestion jobs with a pool of local worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.CARD_JOB_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=settings.CARD_JOB_POLL_INTERVAL)
+
+    def handle(self, *args, **options):
+        service = IngestionJobService()
+        self.__requeue_stale(service)
+        registry.remove_dead()
+
+        preload_models()
+        signal.signal(signal.SIGTERM, _interrupt)
+        context = multiprocessing.get_context('fork')
+        workers = [self.__start_worker(context, options['poll_interval']) for _ in range(options['workers'])]
+        self.stdout.write(f'Started {len(workers)} card job worker(s)')
+
+        try:
+            while True:
+                time.sleep(SUPERVISE_INTERVAL)
+                # Jobs of a worker that crashed or was killed mid-job stay 'processing' until requeued
+                self.__requeue_stale(service)
+                for i, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        logger.warning("Card job worker %s exited with code %s, starting a new one",
+                                       worker.pid, worker.exitcode)
+                        registry.remove(worker.pid)
+                        workers[i] = self.__start_worker(context, options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+                registry.remove(worker.pid)
+
+    def __requeue_stale(self, service: IngestionJobService):
+        try:
+            requeued = service.requeue_stale()
+        except Exception:
+            logger.exception("Could not requeue stale card jobs")
+            requeued = 0
+        finally:
+            close_old_connections()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+
+    @staticmethod
+    def __start_worker(context, poll_interval):
+        # Forked workers must not inherit the parent's database connection
+        connections.close_all()
+        worker = context.Process(target=run_worker, args=(poll_interval,), daemon=True)
+        worker.start()
+        return worker
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that should only be imported once an OCR pipeline actually runs
+HEAVY_MODULES = ('torch', 'easyocr', 'rembg', 'onnxruntime', 'skimage', 'matplotlib', 'sympy', 'tifffile')
+
+
+class Command(BaseCommand):
+    help = ('Starts a fresh interpreter with python -X importtime, sets up Django, imports the given modules '
+            'and reports the slowest imports')
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*',
+                            default=['djangoProject.urls', 'cardreader.services.ingestion_job_service'],
+                            help='Modules to import after django.setup(), by default what the web and job '
+                                 'workers load at startup')
+        parser.add_argument('--top', type=int, default=25)
+        parser.add_argument('--self-time', action='store_true',
+                            help='Sort by the time spent in the module itself instead of including its imports')
+
+    def handle(self, *args, **options):
+        code = 'import django; django.setup()\n' + ''.join(f'import {module}\n' for module in options['modules'])
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE',
+                                                                      'djangoProject.settings')}
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=settings.BASE_DIR,
+                                   capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if completed.returncode != 0:
+            raise CommandError(completed.stderr.strip().splitlines()[-1])
+
+        imports = self.__parse(completed.stderr)
+        key = 1 if options['self_time'] else 2
+        self.stdout.write(f'{"cumulative ms":>14} {"self ms":>9}  module')
+        for module, self_us, cumulative_us in sorted(imports, key=lambda row: row[key], reverse=True)[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {module}')
+        self.stdout.write(f'\n{len(imports)} modules imported, interpreter finished in {elapsed:.2f} s')
+
+        imported = {module for module, _, _ in imports}
+        heavy = [module for module in HEAVY_MODULES if module in imported]
+        if heavy:
+            self.stdout.write(self.style.WARNING(f'Heavy modules imported at startup: {", ".join(heavy)}'))
+
+    @staticmethod
+    def __parse(output):
+        # Lines look like "import time:       412 |       1730 |   cardreader.models"
+        imports = []
+        for line in output.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|', 2)
+            if not self_us.strip().isdigit():
+                continue
+            imports.append((module.strip(), int(self_us), int(cumulative_us)))
+        return imports
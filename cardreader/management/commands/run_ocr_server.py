@@ -0,0 +1,142 @@
+import logging
+import multiprocessing
+import os
+import signal
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cardreader.services.metrics_service import registry
+from cardreader.services.ocr_client_service import attach_images
+from cardreader.services.preload_service import preload_models, after_fork
+from cardreader.services.reader_service import OcrReader, AllowlistOption, get_reader_pool
+from cardreader.services.tracing_service import span
+
+logger = logging.getLogger(__name__)
+
+
+def _interrupt(signum, frame):
+    # docker stop and systemd send SIGTERM, which unwinds the parent like Ctrl-C
+    raise KeyboardInterrupt
+
+
+def serve(listener, cores, threads, connections):
+    """
+    Worker loop: accepts connections from the listener shared by all workers while it has a free
+    connection thread, so an idle worker picks up the next waiting request. Reads arriving on the
+    connection threads at the same time are merged by the recognition batcher.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    after_fork()
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    import torch
+    torch.set_num_threads(threads)
+    if settings.OCR_BACKEND == 'onnx':
+        # Otherwise OCR_ONNX_INTRA_THREADS=0 gives every worker's sessions all cores of the machine
+        get_reader_pool().onnx_threads = (threads, settings.OCR_ONNX_INTER_THREADS)
+
+    reader = OcrReader(remote=False)
+    free = threading.Semaphore(connections)
+    executor = ThreadPoolExecutor(max_workers=connections, thread_name_prefix='ocr-connection')
+    while True:
+        free.acquire()
+        try:
+            connection = listener.accept()
+        except (OSError, EOFError, multiprocessing.AuthenticationError):
+            free.release()
+            continue
+        executor.submit(respond, reader, connection).add_done_callback(lambda _: free.release())
+
+
+def respond(reader: OcrReader, connection):
+    with connection:
+        try:
+            request = connection.recv()
+        except (OSError, EOFError):
+            return
+        try:
+            response = ('ok', handle(reader, request))
+        except Exception as err:
+            logger.exception("OCR request failed")
+            response = ('error', repr(err))
+        try:
+            connection.send(response)
+        except OSError:
+            # The client gave up waiting
+            pass
+
+
+def handle(reader: OcrReader, request):
+    shm, images = attach_images(request['shm'], request['items'])
+    items = []
+    try:
+        # Only the easyocr reads are sent here, the other engines run in the calling process
+        items = [(image, AllowlistOption[allowlist_name] if allowlist_name else None, 'easyocr')
+                 for image, allowlist_name in images]
+        with span('ocr.server', request_id=request['request_id'], op=request['op'], pid=os.getpid()):
+            return reader.read_batch(items, detail=request['detail'], detect=request['detect'])
+    finally:
+        # The views into the block have to be gone before it can be closed
+        del images, items
+        try:
+            shm.close()
+        except BufferError:
+            # The read failed and the exception's traceback still holds a view, the mapping is
+            # released once it is collected
+            pass
+
+
+class Command(BaseCommand):
+    help = 'Runs the OCR worker processes OcrReader sends its reads to when OCR_SERVER_ENABLED is set'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.OCR_SERVER_WORKERS)
+        parser.add_argument('--threads', type=int, default=settings.OCR_SERVER_THREADS,
+                            help='Torch intra-op threads, and pinned cores, per worker')
+        parser.add_argument('--connections', type=int, default=settings.OCR_SERVER_CONNECTIONS,
+                            help='Requests each worker handles at the same time')
+        parser.add_argument('--no-pinning', action='store_true')
+
+    def handle(self, *args, **options):
+        address = settings.OCR_SERVER_ADDRESS
+        # A socket left behind by a server that did not shut down cleanly
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        listener = Listener(address, family='AF_UNIX', authkey=settings.OCR_SERVER_AUTHKEY.encode())
+
+        registry.remove_dead()
+        threads = max(1, options['threads'])
+        if settings.OCR_BACKEND != 'onnx' or threads == 1:
+            # Preloaded ONNX sessions would keep their thread count in the workers
+            preload_models(['ocr'])
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        context = multiprocessing.get_context('fork')
+        workers = []
+        for i in range(options['workers']):
+            cores = None
+            if available and not options['no_pinning']:
+                cores = {available[(i * threads + j) % len(available)] for j in range(threads)}
+            workers.append(context.Process(target=serve, args=(listener, cores, threads, max(1, options['connections'])), daemon=True))
+        signal.signal(signal.SIGTERM, _interrupt)
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {len(workers)} OCR worker(s) on {address}')
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+            listener.close()
+            for worker in workers:
+                registry.remove(worker.pid)
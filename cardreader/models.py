@@ -1,10 +1,10 @@
 import os
 
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.db.models import Model
 from rest_framework_api_key.models import APIKey
-from skimage.color.rgb_colors import black
 
 
 class User(AbstractUser):
@@ -104,6 +104,65 @@ class Invitation(models.Model):
 
 
 
+class CardIngestionJob(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    cardType = models.CharField(
+        max_length=20,
+        choices=(('idcard', 'ID card'), ('studentcard', 'Student card'), ('healthcard', 'Healthcare card'))
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=(('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')),
+        default='pending'
+    )
+    imageFront = models.FileField(upload_to='jobs/', blank=True)
+    imageBack = models.FileField(upload_to='jobs/', blank=True)
+    idCard = models.ForeignKey(IdCard, on_delete=models.SET_NULL, null=True, blank=True)
+    studentCard = models.ForeignKey(StudentCard, on_delete=models.SET_NULL, null=True, blank=True)
+    healthCareCard = models.ForeignKey(HealthCareCard, on_delete=models.SET_NULL, null=True, blank=True)
+    error = models.TextField(blank=True)
+    # Id of the upload request, so the worker's spans join the same trace
+    requestId = models.CharField(max_length=64, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'createdAt'])]
+
+    @property
+    def card(self):
+        return self.idCard or self.studentCard or self.healthCareCard
+
+
+class CardReadCache(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    cardType = models.CharField(max_length=20)
+    fields = models.JSONField(encoder=DjangoJSONEncoder)
+    imageFront = models.BinaryField()
+    imageBack = models.BinaryField(null=True, blank=True)
+    imageFormat = models.CharField(max_length=10, default='jpeg')
+    createdAt = models.DateTimeField(auto_now_add=True)
+    expiresAt = models.DateTimeField(db_index=True)
+
+
+class IdempotencyRecord(models.Model):
+    key = models.CharField(max_length=255)
+    scope = models.CharField(max_length=128)
+    requestPath = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=20,
+        choices=(('in_progress', 'In progress'), ('completed', 'Completed')),
+        default='in_progress'
+    )
+    responseStatus = models.PositiveSmallIntegerField(null=True, blank=True)
+    responseBody = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # Every reservation purges the rows older than the retention period by it
+    createdAt = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key')]
+
+
 class Company(models.Model):
     name = models.CharField(max_length=120)
     vatNumber = models.CharField(max_length=120)
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchRequest:
+    key: object
+    images: list
+    future: Future
+
+    def __init__(self, key, images):
+        self.key = key
+        self.images = images
+        self.future = Future()
+
+
+class MicroBatcher:
+    """
+    Merges the images submitted by concurrent callers into shared inference calls.
+
+    A dispatcher thread takes the first waiting request, then keeps collecting requests for at
+    most `max_wait` seconds or until `max_items` images are gathered. Requests with the same key
+    are run as one batch by `run_batch(key, images)` and every caller's future receives its own
+    slice of the results together with the size of the batch it was part of.
+    """
+    max_items: int
+    max_wait: float
+
+    def __init__(self, run_batch, max_items: int, max_wait: float, dispatchers: int = 1, name='micro-batcher'):
+        self.run_batch = run_batch
+        self.max_items = max(1, max_items)
+        self.max_wait = max_wait
+        self.__pending = queue.Queue()
+        for i in range(max(1, dispatchers)):
+            threading.Thread(target=self.__dispatch, name=f'{name}-{i}', daemon=True).start()
+
+    def submit(self, key, images) -> Future:
+        request = BatchRequest(key, list(images))
+        self.__pending.put(request)
+        return request.future
+
+    def __dispatch(self):
+        while True:
+            # No local of this frame may keep the last batch, and with it the callers' images, alive
+            # while the next get() blocks
+            self.__run_groups(self.__collect())
+
+    def __collect(self):
+        requests = [self.__pending.get()]
+        count = len(requests[0].images)
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.__pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            count += len(request.images)
+        return requests
+
+    def __run_groups(self, requests):
+        groups = {}
+        for request in requests:
+            groups.setdefault(request.key, []).append(request)
+        for key, group in groups.items():
+            self.__run(key, group)
+
+    def __run(self, key, requests):
+        images = [image for request in requests for image in request.images]
+        try:
+            results = self.run_batch(key, images)
+        except Exception as err:
+            for request in requests:
+                request.future.set_exception(err)
+            return
+
+        start = 0
+        for request in requests:
+            end = start + len(request.images)
+            request.future.set_result((results[start:end], len(images)))
+            start = end
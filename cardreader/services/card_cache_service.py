@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections
+from django.db.models import Model
+from django.utils import timezone
+
+from cardreader.models import CardReadCache, User
+from cardreader.services.executor_service import get_image_writer
+from cardreader.services.image_storage_service import EncodedImage, ImageStorageService
+from cardreader.services.metrics_service import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+class CachedCardRead:
+    fields: dict
+    images: dict[str, EncodedImage]
+    expires_at: float
+
+    def __init__(self, fields: dict, images: dict[str, EncodedImage], expires_at: float):
+        self.fields = fields
+        self.images = images
+        self.expires_at = expires_at
+
+
+_memory_cache: OrderedDict[str, CachedCardRead] = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+class CardCacheService:
+    """
+    Remembers the fields extracted from an exact upload, keyed by a hash of the raw image bytes.
+    An in-process LRU answers repeated uploads without a query, the database tier shares the
+    results between worker processes until they expire.
+    """
+    EXCLUDED_FIELDS = ('id', 'user', 'imageFront', 'imageBack')
+
+    def __init__(self):
+        self.storageService = ImageStorageService()
+
+    def key(self, card_type: str, *files: File) -> str | None:
+        """
+        Hashes the uploaded files, or returns None without reading them when the cache is disabled.
+        """
+        if not settings.CARD_CACHE_ENABLED:
+            return None
+
+        digest = hashlib.sha256(card_type.encode())
+        for file in files:
+            file.seek(0)
+            for chunk in file.chunks():
+                digest.update(chunk)
+            digest.update(b'\0')
+            file.seek(0)
+        return digest.hexdigest()
+
+    def get_card(self, key: str | None, model_class: type[Model], user: User | None):
+        """
+        Returns the cached card model and its encoded images, or None on a miss.
+        """
+        if not settings.CARD_CACHE_ENABLED:
+            return None
+
+        cached = self.__get_memory(key)
+        if cached is not None:
+            CACHE_LOOKUPS.inc(result='memory_hit')
+        else:
+            cached = self.__get_database(key)
+            CACHE_LOOKUPS.inc(result='database_hit' if cached is not None else 'miss')
+        if cached is None:
+            return None
+        return model_class(user=user, **cached.fields), cached.images
+
+    def put_card(self, key: str | None, card_type: str, card: Model, images: dict[str, np.ndarray]):
+        """
+        Stores the card's fields and images in both tiers. The images are encoded on the image
+        writer thread, so the caller does not wait for it.
+        """
+        if not settings.CARD_CACHE_ENABLED:
+            return
+
+        fields = {field.attname: getattr(card, field.attname)
+                  for field in card._meta.concrete_fields if field.name not in self.EXCLUDED_FIELDS}
+        get_image_writer().submit(self.__store, key, card_type, fields, images)
+
+    def __store(self, key, card_type, fields, images):
+        try:
+            encoded = {field_name: self.storageService.encode(image) for field_name, image in images.items()}
+            expires_at = timezone.now() + timedelta(seconds=settings.CARD_CACHE_TTL)
+            self.__put_memory(key, CachedCardRead(fields, encoded, expires_at.timestamp()))
+
+            CardReadCache.objects.filter(expiresAt__lt=timezone.now()).delete()
+            try:
+                CardReadCache.objects.update_or_create(key=key, defaults={
+                    'cardType': card_type,
+                    'fields': fields,
+                    'imageFront': encoded['imageFront'].data,
+                    'imageBack': encoded['imageBack'].data if 'imageBack' in encoded else None,
+                    'imageFormat': encoded['imageFront'].ext,
+                    'expiresAt': expires_at,
+                })
+            except IntegrityError:
+                # Another worker stored the same upload at the same time
+                pass
+        except Exception:
+            logger.exception("Could not cache card read %s", key)
+        finally:
+            close_old_connections()
+
+    def __get_memory(self, key) -> CachedCardRead | None:
+        with _memory_cache_lock:
+            cached = _memory_cache.get(key)
+            if cached is None:
+                return None
+            if cached.expires_at < time.time():
+                del _memory_cache[key]
+                return None
+            _memory_cache.move_to_end(key)
+            return cached
+
+    def __put_memory(self, key, cached: CachedCardRead):
+        with _memory_cache_lock:
+            _memory_cache[key] = cached
+            _memory_cache.move_to_end(key)
+            while len(_memory_cache) > settings.CARD_CACHE_MEMORY_SIZE:
+                _memory_cache.popitem(last=False)
+
+    def __get_database(self, key) -> CachedCardRead | None:
+        entry = CardReadCache.objects.filter(key=key, expiresAt__gt=timezone.now()).first()
+        if entry is None:
+            return None
+
+        images = {'imageFront': EncodedImage(bytes(entry.imageFront), entry.imageFormat)}
+        if entry.imageBack is not None:
+            images['imageBack'] = EncodedImage(bytes(entry.imageBack), entry.imageFormat)
+        cached = CachedCardRead(entry.fields, images, entry.expiresAt.timestamp())
+        self.__put_memory(key, cached)
+        return cached
@@ -0,0 +1,137 @@
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+# ID-1 format (ISO/IEC 7810) used by the ID, student and healthcare cards: 85.60 mm x 53.98 mm
+ID1_ASPECT_RATIO = 85.60 / 53.98
+
+
+def order_quad(points) -> np.ndarray:
+    """
+    Orders four corner points as top-left, top-right, bottom-right, bottom-left.
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+class CardLocation:
+    quad: np.ndarray
+    confidence: float
+
+    def __init__(self, quad, confidence: float):
+        self.quad = order_quad(quad)
+        self.confidence = confidence
+
+
+class CardLocalizer:
+    def locate(self, image) -> CardLocation | None:
+        raise NotImplementedError
+
+
+class ContourCardLocalizer(CardLocalizer):
+    """
+    Finds the card with classical OpenCV only: edge detection, quadrilateral fitting
+    and a check against the ID-1 aspect ratio.
+    """
+    WORKING_SIDE = 800
+    MIN_AREA_FRACTION = 0.15
+
+    def locate(self, image) -> CardLocation | None:
+        h, w = image.shape[:2]
+        scale = min(1.0, self.WORKING_SIDE / max(h, w))
+        small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        median = float(np.median(gray))
+        edges = cv2.Canny(gray, int(max(0, 0.66 * median)), int(min(255, 1.33 * median)))
+        edges = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)), iterations=2)
+
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        image_area = small.shape[0] * small.shape[1]
+        best_quad, best_confidence = None, 0.0
+        for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+            area = cv2.contourArea(contour)
+            if area < self.MIN_AREA_FRACTION * image_area:
+                break
+            approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+            if len(approx) != 4 or not cv2.isContourConvex(approx):
+                continue
+
+            confidence = self.__score(order_quad(approx), area)
+            if confidence > best_confidence:
+                best_quad, best_confidence = approx, confidence
+
+        if best_quad is None:
+            return None
+        return CardLocation(best_quad.reshape(4, 2) / scale, best_confidence)
+
+    @staticmethod
+    def __score(quad, area):
+        top, bottom = np.linalg.norm(quad[1] - quad[0]), np.linalg.norm(quad[2] - quad[3])
+        left, right = np.linalg.norm(quad[3] - quad[0]), np.linalg.norm(quad[2] - quad[1])
+        width, height = (top + bottom) / 2, (left + right) / 2
+        if min(width, height) == 0:
+            return 0.0
+
+        aspect_ratio = max(width, height) / min(width, height)
+        aspect_score = max(0.0, 1 - abs(aspect_ratio - ID1_ASPECT_RATIO) / ID1_ASPECT_RATIO * 4)
+        (_, _), (rect_w, rect_h), _ = cv2.minAreaRect(quad)
+        rectangularity = area / (rect_w * rect_h) if rect_w * rect_h else 0.0
+        return float(aspect_score * min(1.0, rectangularity))
+
+
+class RembgCardLocalizer(CardLocalizer):
+    """
+    Segments the card with the rembg U2-Net model. Slow, but robust against busy backgrounds.
+    """
+    _session = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    # rembg loads onnxruntime, only import it when the fallback engine actually runs
+                    from rembg import new_session
+                    cls._session = new_session('u2net')
+        return cls._session
+
+    def locate(self, image) -> CardLocation | None:
+        # Only the corners are needed, so segment a downscaled proxy and map them back
+        h, w = image.shape[:2]
+        scale = min(1.0, settings.CARD_SEGMENTATION_MAX_SIDE / max(h, w))
+        proxy = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+
+        session = self.get_session()
+        from rembg import remove
+        output = remove(proxy, session=session)
+
+        output_bw = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY)
+
+        mask = np.where(output_bw < 20, 0, 255).astype(np.uint8)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+        cleaned_mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+        contours, _ = cv2.findContours(cleaned_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+
+        quad = cv2.boxPoints(cv2.minAreaRect(max(contours, key=cv2.contourArea))) / scale
+        return CardLocation(quad, 1.0)
+
+
+LOCALIZERS = {
+    'contour': ContourCardLocalizer,
+    'rembg': RembgCardLocalizer,
+}
@@ -1,6 +1,6 @@
-import base64
+import binascii
+import mmap
 import uuid
-from io import BytesIO
 
 import cv2
 import numpy as np
@@ -13,63 +13,129 @@ class ConverterService:
         """
         Converts a base64 image string into a Django ContentFile.
         """
-        file_format, img_str = image_string.split(';base64,')  # Get the content type
-        image_bytes = base64.b64decode(img_str)  # Decode the base64 string
-        image_file = BytesIO(image_bytes)
+        ext, image_bytes = self.__decode_data_url(image_string)
 
-        # Generate a unique filename
-        ext = file_format.split('/')[-1]  # Get the file extension (e.g., 'jpeg' or 'png')
-        unique_filename = f"{timezone.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}.{ext}"
-
-        image_file = ContentFile(image_bytes, name=unique_filename)
+        # The ContentFile keeps the decoded bytes as its only copy, reading it back does not copy them again
+        return self.bytes_to_file(image_bytes, ext)
 
-        return image_file
+    REDUCED_DECODE_FLAGS = {
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+    }
 
-    def file_to_numpy(self, file):
+    def file_to_numpy(self, file, max_side=None):
         """
         Converts a file-like object to a NumPy array using OpenCV.
+        When max_side is given, the image is downscaled while decoding so that its longer side
+        ends up near max_side: JPEGs are decoded at the reduced DCT scale closest to it, anything
+        still larger is resized. Files that live on local disk are decoded from a memory-mapped view instead
+        of being read into memory first.
         """
-        image_np = np.frombuffer(file.read(), np.uint8)
+        path = self.__local_path(file)
+        if path is None:
+            return self.__decode(file.read(), max_side)
+
+        with open(path, 'rb') as image_file:
+            mapped = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return self.__decode(mapped, max_side)
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # A traceback still references the view, the map is released with it
+                    pass
+
+    def __decode(self, buffer, max_side):
+        image_np = np.frombuffer(buffer, np.uint8)
 
         # Decode the NumPy array into an image (OpenCV format)
-        image_array = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+        image_array = cv2.imdecode(image_np, self.__decode_flag(image_np, max_side))
 
         if image_array is None:
             raise ValueError("Could not decode the image from the file object")
 
+        if max_side and max(image_array.shape[:2]) > max_side:
+            scale = max_side / max(image_array.shape[:2])
+            image_array = cv2.resize(image_array, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
         return image_array
 
-    def numpy_to_file(self, image_array):
+    @staticmethod
+    def __local_path(file):
+        if hasattr(file, 'temporary_file_path'):
+            return file.temporary_file_path()
+        try:
+            # Files stored on the local file system, e.g. the uploads of an ingestion job
+            return file.path
+        except (AttributeError, NotImplementedError, ValueError):
+            return None
+
+    def bytes_to_file(self, image_bytes, ext):
         """
-        Converts a NumPy array to a Django ContentFile.
+        Wraps encoded image bytes into a Django ContentFile with a unique filename.
         """
-        # Encode the NumPy array into an image format in memory
-        success, image_encoded = cv2.imencode('.jpeg', image_array)
-
-        if not success:
-            raise ValueError("Could not encode image array")
-
-        # Convert the encoded image to a BytesIO object
-        image_bytes = image_encoded.tobytes()
-        unique_filename = f"{timezone.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}.jpeg"
-
-        # Optionally, set the file name or extension for the file-like object
-        image_file = ContentFile(image_bytes, name=unique_filename)
-
-        return image_file
+        unique_filename = f"{timezone.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4()}.{ext}"
+        return ContentFile(image_bytes, name=unique_filename)
 
     def base64_to_numpy(self, image_string):
         """
         Converts a base64 image string into a NumPy array.
         """
-        # Decode the base64 string to get the image bytes
-        file_format, img_str = image_string.split(';base64,')  # Get the content type
-        image_data = base64.b64decode(img_str)
-
-        # Convert the bytes into a BytesIO object
-        image_file = BytesIO(image_data)
-
-        # Convert the BytesIO object to a NumPy array
-        image_np = np.frombuffer(image_file.read(), np.uint8)
-
-        return image_np
+        _, image_bytes = self.__decode_data_url(image_string)
+        return np.frombuffer(image_bytes, np.uint8)
+
+    def __decode_flag(self, image_np, max_side):
+        size = self.__jpeg_size(image_np) if max_side else None
+        if size is None:
+            return cv2.IMREAD_COLOR
+
+        # The scale landing nearest max_side wins, even a little below it: a reduced decode is
+        # much cheaper than a full decode followed by a resize
+        longest = max(size)
+        best_factor, best_flag = 1, cv2.IMREAD_COLOR
+        for factor, flag in self.REDUCED_DECODE_FLAGS.items():
+            if abs(longest / factor - max_side) < abs(longest / best_factor - max_side):
+                best_factor, best_flag = factor, flag
+        return best_flag
+
+    @staticmethod
+    def __jpeg_size(data):
+        """
+        Reads the (width, height) of a JPEG from its start-of-frame header, without decoding it.
+        Returns None for anything that is not a JPEG.
+        """
+        if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+            return None
+
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height = (int(data[i + 5]) << 8) + int(data[i + 6])
+                width = (int(data[i + 7]) << 8) + int(data[i + 8])
+                return width, height
+            i += 2 + (int(data[i + 2]) << 8) + int(data[i + 3])
+        return None
+
+    @staticmethod
+    def __decode_data_url(image_string):
+        """
+        Decodes a data URL into its file extension and image bytes.
+        The payload is decoded from a view of the string, without slicing a copy of it out first.
+        """
+        separator = ';base64,'
+        header_end = image_string.find(separator)
+        if header_end < 0:
+            raise ValueError("Image is not a base64 data URL")
+
+        file_format = image_string[:header_end]  # Get the content type, e.g. 'data:image/jpeg'
+        ext = file_format.split('/')[-1]
+        payload = memoryview(image_string.encode('ascii'))[header_end + len(separator):]
+        return ext, binascii.a2b_base64(payload)
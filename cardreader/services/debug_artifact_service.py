@@ -0,0 +1,100 @@
+import logging
+import os
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from cardreader.services.executor_service import get_debug_writer
+from cardreader.services.tracing_service import current_span
+
+logger = logging.getLogger(__name__)
+
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def sampled() -> bool:
+    """
+    Whether debug artifacts are kept for the current request. The decision is a hash of the
+    request id, so the web process and the job worker agree on it without sharing state.
+    """
+    rate = settings.DEBUG_ARTIFACTS_RATE
+    if rate <= 0:
+        return False
+    current = current_span()
+    if current is None:
+        return False
+    return zlib.crc32(current.request_id.encode()) / 2 ** 32 < rate
+
+
+def save_image(name: str, image: np.ndarray):
+    if sampled():
+        _submit(name, image.copy(), None)
+
+
+def save_ocr(image: np.ndarray, result):
+    """
+    Keeps the region sent to OCR with the recognized boxes, text and confidences drawn onto it.
+    """
+    if sampled():
+        _submit('ocr', image.copy(), list(result))
+
+
+def _submit(name, image, result):
+    global _pending
+    if _pending is None:
+        with _pending_lock:
+            if _pending is None:
+                _pending = threading.BoundedSemaphore(settings.DEBUG_ARTIFACTS_QUEUE_SIZE)
+    # Artifacts are dropped rather than queued without bound when the disk can not keep up
+    if not _pending.acquire(blocking=False):
+        return
+
+    current = current_span()
+    label = '-'.join(str(part) for part in (
+        current.request_id, current.attributes.get('card_type'), current.attributes.get('field'), name
+    ) if part)
+    get_debug_writer().submit(_write, label, image, result)
+
+
+def _write(label, image, result):
+    try:
+        if result is not None:
+            image = _draw_overlay(image, result)
+        directory = settings.DEBUG_ARTIFACTS_DIR
+        os.makedirs(directory, exist_ok=True)
+        cv2.imwrite(os.path.join(directory, f'{time.time_ns()}-{label}.png'), image)
+        _prune(directory)
+    except Exception:
+        logger.exception("Could not write debug artifact %s", label)
+    finally:
+        _pending.release()
+
+
+def _draw_overlay(image, result):
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    for item in result:
+        if not isinstance(item, (tuple, list)):
+            continue
+        box, text, prob = item
+        points = np.array(box, dtype=np.int32)
+        cv2.polylines(image, [points], isClosed=True, color=(0, 0, 255), thickness=1)
+        x, y = points[0]
+        cv2.putText(image, f'{text} {prob:.2f}', (int(x), max(int(y) - 3, 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1, cv2.LINE_AA)
+    return image
+
+
+def _prune(directory):
+    # File names start with the write time, so the oldest artifacts sort first
+    files = sorted(name for name in os.listdir(directory) if name.endswith('.png'))
+    for name in files[:max(len(files) - settings.DEBUG_ARTIFACTS_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,53 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+_executor = None
+_image_writer = None
+_debug_writer = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.CARD_SIDE_WORKERS,
+                                               thread_name_prefix='card-side')
+    return _executor
+
+
+def get_image_writer() -> ThreadPoolExecutor:
+    global _image_writer
+    if _image_writer is None:
+        with _executor_lock:
+            if _image_writer is None:
+                _image_writer = ThreadPoolExecutor(max_workers=settings.CARD_IMAGE_WRITERS,
+                                                   thread_name_prefix='card-image-writer')
+    return _image_writer
+
+
+def get_debug_writer() -> ThreadPoolExecutor:
+    global _debug_writer
+    if _debug_writer is None:
+        with _executor_lock:
+            if _debug_writer is None:
+                _debug_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='card-debug-writer')
+    return _debug_writer
+
+
+def run_concurrently(*calls):
+    """
+    Runs the callables on the shared bounded executor and returns their results in order.
+    The first exception raised by any of them is re-raised once all of them have finished.
+    """
+    # Each call runs in a copy of the caller's context, so its spans nest under the caller's span
+    futures = [get_executor().submit(contextvars.copy_context().run, call) for call in calls]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
@@ -1,10 +1,13 @@
 import numpy as np
+from django.conf import settings
 from django.core.files import File
 
 from cardreader.models import User, HealthCareCard
+from cardreader.services.card_cache_service import CardCacheService
 from cardreader.services.converter_service import ConverterService
 from cardreader.services.data_processor_service import DataProcessorService
 from cardreader.services.image_processing_service import ImageProcessingService
+from cardreader.services.metrics_service import timed
 from cardreader.services.reader_service import OcrReader, AllowlistOption
 
 
@@ -18,6 +21,7 @@ class HealthCareCardData:
 class HealthCareCardReaderService:
     image_file: File
     image: np.ndarray
+    images: dict
     user: User
     reader: OcrReader
     cardData: HealthCareCard
@@ -33,49 +37,46 @@ class HealthCareCardReaderService:
         self.processing_service = ImageProcessingService()
         self.converterService = ConverterService()
         self.dataProcessorService = DataProcessorService()
+        self.cacheService = CardCacheService()
 
     def read_data(self):
+        cache_key = self.cacheService.key('healthcard', self.image_file)
+        cached = self.cacheService.get_card(cache_key, HealthCareCard, self.user)
+        if cached is not None:
+            card, self.images = cached
+            return card
+
         self.remove_backgrounds()
-        self.read_name()
-        self.read_birth_date()
-        self.read_issue_date()
-        self.read_card_number()
+        self.read_fields()
+        self.images = {'imageFront': self.image}
+        self.cacheService.put_card(cache_key, 'healthcard', self.cardData, self.images)
         return self.cardData
 
-    def read_birth_date(self):
-        image = self.processing_service.crop_image(self.image, (0.47, 0.62), (0.27, 0.6))
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.DATES)
-        print(result)
-        self.cardData.birthDate = self.dataProcessorService.process_date(result, accuracy_treshold=0.7)
-
-    def read_name(self):
-        cropped_image = self.processing_service.crop_image(self.image, (0.25, 0.42), (0.2, 0.8))
-        name = ''
-        #processed_image = self.processing_service.preprocess_image(cropped_image, ksize=9, treshold=90)
-        result = self.reader.read(cropped_image, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
-        name = self.dataProcessorService.process_name(result)
-
-        self.processing_service.imshow(cropped_image)
-        print(result)
-        self.cardData.name = name
-
-    def read_issue_date(self):
-        image = self.processing_service.crop_image(self.image, (0.80, 1), (0.35, 0.85))
-        result = self.reader.read(image, show_image=True)
-        print(result)
-        self.cardData.issueDate = self.dataProcessorService.process_date(result)
-
-    def read_card_number(self):
-        image = self.processing_service.crop_image(self.image, (0.62, 0.82), (0.1, 0.65))
-        result = self.reader.read(image, show_image=True)
-        print(result)
-        card_number = self.dataProcessorService.process_numeric_identifier(result, pattern='[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]')
-        self.cardData.cardNumber = card_number if self.__validate_card_number(card_number) else ""
+    def read_fields(self):
+        crop = self.processing_service.crop_image
+        with timed('ocr', 'healthcard', 'name_and_issue_date'):
+            name, issue_date = self.reader.read_batch([
+                (crop(self.image, (0.25, 0.42), (0.2, 0.8)), AllowlistOption.UPPERCASE_HUNGARIAN),
+                (crop(self.image, (0.80, 1), (0.35, 0.85)), None, 'numeric'),
+            ])
+        with timed('ocr', 'healthcard', 'birth_date_and_card_number'):
+            birth_date, card_number = self.reader.read_batch([
+                (crop(self.image, (0.47, 0.62), (0.27, 0.6)), AllowlistOption.DATES, 'numeric'),
+                (crop(self.image, (0.62, 0.82), (0.1, 0.65)), None, 'numeric'),
+            ], detect=False)
+        with timed('parse', 'healthcard', 'front'):
+            self.cardData.name = self.dataProcessorService.process_name(name)
+            self.cardData.birthDate = self.dataProcessorService.process_date(birth_date, accuracy_threshold=0.7)
+            self.cardData.issueDate = self.dataProcessorService.process_date(issue_date)
+            card_number = self.dataProcessorService.process_numeric_identifier(card_number, pattern='[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]')
+        with timed('validate', 'healthcard', 'card_number'):
+            self.cardData.cardNumber = card_number if self.__validate_card_number(card_number) else ""
 
     def remove_backgrounds(self):
-        self.image = self.processing_service.remove_background(self.converterService.file_to_numpy(self.image_file))
-        self.image_file = self.converterService.numpy_to_file(self.image)
-        self.cardData.imageFront = self.image_file
+        with timed('decode', 'healthcard', 'front'):
+            image = self.converterService.file_to_numpy(self.image_file, settings.CARD_DECODE_MAX_SIDES['healthcard'])
+        with timed('remove_background', 'healthcard', 'front'):
+            self.image = self.processing_service.extract_card(image, 'healthcard')
 
     def __validate_card_number(self, card_number):
         if len(card_number) != 9 or not card_number.isdigit():
@@ -1,13 +1,16 @@
 import numpy as np
+from django.conf import settings
 from django.core.files import File
-from easyocr import Reader
 
 from cardreader.dtos.id_card_dtos import IdCardData
 from cardreader.models import User, IdCard
+from cardreader.services.card_cache_service import CardCacheService
 from cardreader.services.converter_service import ConverterService
 from cardreader.services.data_processor_service import DataProcessorService
+from cardreader.services.executor_service import run_concurrently
 from cardreader.services.idcard_validator_service import IdCardValidatorService
 from cardreader.services.image_processing_service import ImageProcessingService
+from cardreader.services.metrics_service import timed
 from cardreader.services.reader_service import OcrReader, AllowlistOption
 
 
@@ -16,6 +19,7 @@ class IdCardReaderService:
     image_file_back: File
     image_front: np.ndarray
     image_back: np.ndarray
+    images: dict
     user: User
     cardData: IdCardData
     reader: OcrReader
@@ -30,77 +34,76 @@ class IdCardReaderService:
         self.converterService = ConverterService()
         self.image_processing_service = ImageProcessingService()
         self.dataProcessorService = DataProcessorService()
+        self.cacheService = CardCacheService()
 
     def read_data(self):
-        self.remove_backgrounds()
-        self.read_front()
-        self.read_back()
-        self.cardData = IdCardValidatorService(self.cardData).validate()
-        return self.create_model()
+        cache_key = self.cacheService.key('idcard', self.image_file_front, self.image_file_back)
+        cached = self.cacheService.get_card(cache_key, IdCard, self.user)
+        if cached is not None:
+            card, self.images = cached
+            return card
 
+        self.remove_backgrounds()
+        run_concurrently(self.read_front, self.read_back)
+        with timed('validate', 'idcard'):
+            self.cardData = IdCardValidatorService(self.cardData).validate()
+        card = self.create_model()
+        self.images = {'imageFront': self.image_front, 'imageBack': self.image_back}
+        self.cacheService.put_card(cache_key, 'idcard', card, self.images)
+        return card
 
     def remove_backgrounds(self):
-        self.image_front = self.image_processing_service.remove_background(self.converterService.file_to_numpy(self.image_file_front))
-        self.image_back = self.image_processing_service.remove_background(self.converterService.file_to_numpy(self.image_file_back))
-        self.image_file_front = self.converterService.numpy_to_file(self.image_front)
-        self.image_file_back = self.converterService.numpy_to_file(self.image_back)
+        self.image_front, self.image_back = run_concurrently(
+            lambda: self.__extract_card(self.image_file_front, 'front'),
+            lambda: self.__extract_card(self.image_file_back, 'back'),
+        )
+
+    def __extract_card(self, image_file, side):
+        with timed('decode', 'idcard', side):
+            image = self.converterService.file_to_numpy(image_file, settings.CARD_DECODE_MAX_SIDES['idcard'])
+        with timed('remove_background', 'idcard', side):
+            return self.image_processing_service.extract_card(image, 'idcard')
 
     def read_front(self):
-        self.read_name()
-        self.read_sex()
-        self.read_nationality()
-        self.read_birth()
-        self.read_expiry()
-        self.read_identifier()
-        self.read_can()
+        crop = self.image_processing_service.crop_image
+        with timed('ocr', 'idcard', 'name'):
+            name = self.reader.read(crop(self.image_front, (0.23, 0.3757), (0.3437, 0.7936)),
+                                    allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
+        with timed('ocr', 'idcard', 'front_fields'):
+            sex, nationality, birth, expiry, identifier, can = self.reader.read_batch([
+                (crop(self.image_front, (0.4208, 0.5109), (0.4594, 0.6483)), None),
+                (crop(self.image_front, (0.4208, 0.4909), (0.8928, 1.0)), None),
+                (crop(self.image_front, (0.4709, 0.5511), (0.6944, 1.0)), None, 'numeric'),
+                (crop(self.image_front, (0.5260, 0.6012), (0.6944, 1.0)), None, 'numeric'),
+                (crop(self.image_front, (0.5661, 0.6663), (0.6944, 1.0)), None),
+                (crop(self.image_front, (0.6262, 0.7515), (0.4298, 0.6779)), None, 'numeric'),
+            ], detect=False)
+        with timed('parse', 'idcard', 'front'):
+            self.cardData.name = self.dataProcessorService.process_name(name)
+            self.cardData.sex = self.dataProcessorService.process_sex(sex)
+            self.cardData.nationality = self.dataProcessorService.process_nationality(nationality)
+            self.cardData.birthDate = self.dataProcessorService.process_date(birth, remove_spaces=True)
+            self.cardData.expiryDate = self.dataProcessorService.process_date(expiry, remove_spaces=True)
+            self.cardData.identifier = self.dataProcessorService.process_ID_number(identifier)
+            self.cardData.can = self.dataProcessorService.process_numeric_identifier(can, '[0-9][0-9][0-9][0-9][0-9][0-9]')
 
     def read_back(self):
-        self.read_mothers_name()
-        self.read_identifier_back()
-        self.read_birthplace()
-        self.read_mrz()
-
-    def read_name(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.23, 0.3757), (0.3437, 0.7936))
-        #image = self.image_processing_service.preprocess_image(image, 7, 80)
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
-        print(result)
-        self.cardData.name = self.dataProcessorService.process_name(result)
-
-    def read_sex(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.4208, 0.5109), (0.4594, 0.6483))
-        result = self.reader.read(image)
-        self.cardData.sex = self.dataProcessorService.process_sex(result)
-
-    def read_nationality(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.4208, 0.4909), (0.8928, 1.0))
-        result = self.reader.read(image)
-        self.cardData.nationality = self.dataProcessorService.process_nationality(result)
-
-    def read_birth(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.4709, 0.5511), (0.6944, 1.0))
-        result = self.reader.read(image, show_image=True)
-        print(result)
-        self.cardData.birthDate = self.dataProcessorService.process_date(result, remove_spaces=True)
-
-    def read_expiry(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.5260, 0.6012), (0.6944, 1.0))
-        result = self.reader.read(image, show_image=True)
-        print(result)
-        self.cardData.expiryDate = self.dataProcessorService.process_date(result, remove_spaces=True)
-
-    def read_identifier(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.5661, 0.6663), (0.6944, 1.0))
-        result = self.reader.read(image)
-        self.cardData.identifier = self.dataProcessorService.process_ID_number(result)
-
-    def read_can(self):
-        image = self.image_processing_service.crop_image(self.image_front, (0.6262, 0.7515), (0.4298, 0.6779))
-        result = self.reader.read(image)
-        self.cardData.can = self.dataProcessorService.process_numeric_identifier(result, '[0-9][0-9][0-9][0-9][0-9][0-9]')
+        crop = self.image_processing_service.crop_image
+        with timed('ocr', 'idcard', 'back_fields'):
+            mothers_name, identifier_back, birthplace = self.reader.read_batch([
+                (crop(self.image_back, (0.39, 0.47), (0.0, 0.394)), AllowlistOption.UPPERCASE_HUNGARIAN),
+                (crop(self.image_back, (0.3022, 0.4561), (0.6626, 1.0)), None),
+                (crop(self.image_back, (0.09, 0.19), (0.0, 0.394)), AllowlistOption.BIRTHPLACE),
+            ], detect=False)
+        with timed('ocr', 'idcard', 'mrz'):
+            mrz = self.reader.read(crop(self.image_back, (0.6154, 1.0), (0.0, 1.0)), engine='mrz')
+        with timed('parse', 'idcard', 'back'):
+            self.cardData.mothers_name = self.dataProcessorService.process_name(mothers_name)
+            self.cardData.identifier_back = self.dataProcessorService.process_ID_number(identifier_back)
+            self.cardData.birthplace = self.dataProcessorService.process_birthplace(birthplace)
+            self.cardData.mrz = self.dataProcessorService.process_mrz(mrz)
 
     def create_model(self) -> IdCard:
-        print(self.cardData)
         return IdCard(
             name=self.cardData.name,
             sex=self.cardData.sex,
@@ -112,26 +115,4 @@ class IdCardReaderService:
             mothersName=self.cardData.mothers_name,
             birthPlace = self.cardData.birthplace,
             user=self.user,
-            imageFront=self.image_file_front,
-            imageBack=self.image_file_back,
         )
-
-    def read_mothers_name(self):
-        image = self.image_processing_service.crop_image(self.image_back, (0.39, 0.47), (0.0, 0.394))
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
-        self.cardData.mothers_name = self.dataProcessorService.process_name(result)
-
-    def read_birthplace(self):
-        image = self.image_processing_service.crop_image(self.image_back, (0.09, 0.19), (0.0, 0.394))
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.BIRTHPLACE)
-        self.cardData.birthplace = self.dataProcessorService.process_birthplace(result)
-
-    def read_mrz(self):
-        image = self.image_processing_service.crop_image(self.image_back, (0.6154, 1.0), (0.0, 1.0))
-        result = self.reader.read(image)
-        self.cardData.mrz = self.dataProcessorService.process_mrz(result)
-
-    def read_identifier_back(self):
-        image = self.image_processing_service.crop_image(self.image_back, (0.3022, 0.4561), (0.6626, 1.0))
-        result = self.reader.read(image)
-        self.cardData.identifier_back = self.dataProcessorService.process_ID_number(result)
\ No newline at end of file
@@ -1,7 +1,11 @@
 import numpy as np
 import cv2
-from matplotlib import pyplot as plt
-from rembg import remove
+from django.conf import settings
+
+from cardreader.services import debug_artifact_service
+from cardreader.services.card_localization_service import LOCALIZERS, CardLocation, ID1_ASPECT_RATIO
+from cardreader.services.tracing_service import span
+
 
 class ImageProcessingService:
 
@@ -11,35 +15,69 @@ class ImageProcessingService:
         cropped_image = image[int(y[0] * h):int(y[1] * h), int(x[0] * w):int(x[1] * w)]
         return cropped_image
 
-    def imshow(self,  image, size= 10):
-        h, w = image.shape[0], image.shape[1]
-        aspect_ratio = w / h
-        plt.figure(figsize=(size * aspect_ratio, size))
-        plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        plt.show()
-
     def preprocess_image(self, image, ksize, treshold= 100, otsu = False):
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        noise_removed_image = cv2.GaussianBlur(gray_image, (ksize, ksize), 0)
-        resized_image = cv2.resize(noise_removed_image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        resized_image = self.__blur_and_upscale(image, ksize)
         if(otsu):
             _, binary_image = cv2.threshold(resized_image, treshold, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         else:
             _, binary_image = cv2.threshold(resized_image, treshold, 255, cv2.THRESH_BINARY)
         return binary_image
 
-    def remove_background(self, image):
-        output = remove(image)
+    def preprocess_image_variants(self, image, ksize, tresholds):
+        """
+        Converts, blurs and upscales the image once, then binarizes it at every threshold in one
+        vectorized step. Variant i of the returned (len(tresholds), h, w) stack equals
+        preprocess_image(image, ksize, tresholds[i]).
+        """
+        resized_image = self.__blur_and_upscale(image, ksize)
+        tresholds = np.asarray(tresholds, dtype=np.float32).reshape(-1, 1, 1)
+        return np.greater(resized_image[np.newaxis], tresholds).astype(np.uint8) * np.uint8(255)
 
-        output_bw = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY)
+    @staticmethod
+    def __blur_and_upscale(image, ksize):
+        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        noise_removed_image = cv2.GaussianBlur(gray_image, (ksize, ksize), 0)
+        return cv2.resize(noise_removed_image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+    def locate_card(self, image) -> CardLocation | None:
+        """
+        Asks the configured localization engines in order and returns the first location
+        they are confident about. The last engine is the fallback and always accepted.
+        """
+        engines = settings.CARD_LOCALIZATION_ENGINES
+        for i, engine in enumerate(engines):
+            with span('localize', engine=engine) as current:
+                location = LOCALIZERS[engine]().locate(image)
+                current.set_attribute('confidence', location.confidence if location is not None else None)
+            if location is not None and (location.confidence >= settings.CARD_LOCALIZATION_MIN_CONFIDENCE
+                                         or i == len(engines) - 1):
+                return location
+        return None
 
-        mask = np.where(output_bw < 20, 0, 255).astype(np.uint8)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    def extract_card(self, image, card_type: str):
+        """
+        Locates the card and warps it to the canonical ID-1 sized image of the card type,
+        so the fractional field coordinates always cut the same regions at the same resolution.
+        """
+        width = settings.CARD_CANONICAL_WIDTHS[card_type]
+        height = int(round(width / ID1_ASPECT_RATIO))
+
+        location = self.locate_card(image)
+        if location is None:
+            card_image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        else:
+            card_image = self.rectify(image, location.quad, (width, height))
+        debug_artifact_service.save_image('card', card_image)
+        return card_image
 
-        cleaned_mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        # cleaned_mask = cv2.morphologyEx(cleaned_mask, cv2.MORPH_CLOSE, kernel, iterations=3)
+    def rectify(self, image, quad, size: tuple[int, int]):
+        quad = np.asarray(quad, dtype=np.float32)
+        # A card photographed in portrait is turned so that its long side becomes the top edge
+        if np.linalg.norm(quad[3] - quad[0]) > np.linalg.norm(quad[1] - quad[0]):
+            quad = np.roll(quad, -1, axis=0)
 
-        (x, y, w, h) = cv2.boundingRect(cleaned_mask)
-        cropped_image = image[y:(y + h), x:(x + w)]
-        self.imshow(cropped_image)
-        return cropped_image
\ No newline at end of file
+        width, height = size
+        destination = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+        transform = cv2.getPerspectiveTransform(quad, destination)
+        return cv2.warpPerspective(image, transform, (width, height), flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_REPLICATE)
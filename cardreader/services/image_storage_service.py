@@ -0,0 +1,73 @@
+import logging
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Model
+
+from cardreader.services.converter_service import ConverterService
+from cardreader.services.executor_service import get_image_writer
+from cardreader.services.metrics_service import timed
+
+logger = logging.getLogger(__name__)
+
+
+class EncodedImage:
+    data: bytes
+    ext: str
+
+    def __init__(self, data: bytes, ext: str):
+        self.data = data
+        self.ext = ext
+
+
+class ImageStorageService:
+    """
+    Encodes the processed card images and writes them to the card's file fields on a
+    background thread, after the transaction that saved the card has been committed.
+    """
+
+    def __init__(self):
+        self.converterService = ConverterService()
+
+    def encode(self, image: np.ndarray | EncodedImage) -> EncodedImage:
+        if isinstance(image, EncodedImage):
+            return image
+
+        max_side = settings.CARD_IMAGE_MAX_SIDE
+        if max_side and max(image.shape[:2]) > max_side:
+            scale = max_side / max(image.shape[:2])
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        ext = settings.CARD_IMAGE_FORMAT
+        quality_flag = cv2.IMWRITE_WEBP_QUALITY if ext == 'webp' else cv2.IMWRITE_JPEG_QUALITY
+        success, image_encoded = cv2.imencode(f'.{ext}', image, [quality_flag, settings.CARD_IMAGE_QUALITY])
+        if not success:
+            raise ValueError("Could not encode image array")
+        return EncodedImage(image_encoded.tobytes(), ext)
+
+    def save_card_images(self, card: Model, images: dict[str, np.ndarray | EncodedImage]):
+        model_class, pk = type(card), card.pk
+        transaction.on_commit(lambda: get_image_writer().submit(self.__write, model_class, pk, images))
+
+    def __write(self, model_class, pk, images):
+        names = {}
+        try:
+            card_type = model_class._meta.model_name
+            for field_name, image in images.items():
+                with timed('encode', card_type, field_name):
+                    encoded = self.encode(image)
+                field = model_class._meta.get_field(field_name)
+                image_file = self.converterService.bytes_to_file(encoded.data, encoded.ext)
+                with timed('save', card_type, field_name):
+                    names[field_name] = field.storage.save(field.generate_filename(None, image_file.name), image_file)
+
+            if not model_class.objects.filter(pk=pk).update(**names):
+                # The card was deleted before its images were written
+                for field_name, name in names.items():
+                    model_class._meta.get_field(field_name).storage.delete(name)
+        except Exception:
+            logger.exception("Could not store the images of %s %s", model_class.__name__, pk)
+        finally:
+            close_old_connections()
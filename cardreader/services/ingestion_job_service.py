@@ -0,0 +1,95 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from cardreader.models import CardIngestionJob, User
+from cardreader.services.healthcarecard_reader_service import HealthCareCardReaderService
+from cardreader.services.idcard_reader_service import IdCardReaderService
+from cardreader.services.image_storage_service import ImageStorageService
+from cardreader.services.metrics_service import timed
+from cardreader.services.tracing_service import span, current_request_id
+from cardreader.services.studentcard_reader_service import StudentCardReaderService
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJobService:
+    """
+    Database backed queue for the card reading pipelines.
+    Views enqueue the uploaded images, the process_card_jobs workers run read_data() on them.
+    """
+    CARD_FIELDS = {
+        'idcard': 'idCard',
+        'studentcard': 'studentCard',
+        'healthcard': 'healthCareCard',
+    }
+
+    def __init__(self):
+        self.storageService = ImageStorageService()
+
+    def submit(self, card_type: str, user: User, image_front: File, image_back: File = None) -> CardIngestionJob:
+        job = CardIngestionJob(user=user, cardType=card_type, imageFront=image_front,
+                               requestId=current_request_id() or '')
+        if image_back is not None:
+            job.imageBack = image_back
+        job.save()
+        return job
+
+    def claim_next(self) -> CardIngestionJob | None:
+        with transaction.atomic():
+            job = (CardIngestionJob.objects
+                   .select_for_update(skip_locked=True)
+                   .filter(status='pending')
+                   .order_by('createdAt')
+                   .first())
+            if job is None:
+                return None
+            job.status = 'processing'
+            job.save(update_fields=['status', 'updatedAt'])
+        return job
+
+    def process(self, job: CardIngestionJob):
+        # Continues the trace of the request that uploaded the images
+        with span('card_job', request_id=job.requestId or None, job_id=job.id, card_type=job.cardType) as current:
+            try:
+                reader = self.__create_reader(job)
+                with timed('read', job.cardType):
+                    card = reader.read_data()
+                card.save()
+                self.storageService.save_card_images(card, reader.images)
+                setattr(job, self.CARD_FIELDS[job.cardType], card)
+                job.status = 'done'
+            except Exception as err:
+                # The details stay in the logs, the job is readable by the API client
+                logger.exception("Card job %s failed", job.id)
+                job.status = 'failed'
+                job.error = 'The card could not be read'
+                current.set_attribute('error', repr(err))
+            finally:
+                job.imageFront.delete(save=False)
+                job.imageBack.delete(save=False)
+            job.save()
+            current.set_attribute('status', job.status)
+
+    def requeue_stale(self):
+        """
+        Puts jobs back into the queue whose worker died while processing them.
+        """
+        stale_before = timezone.now() - timedelta(seconds=settings.CARD_JOB_STALE_AFTER)
+        return (CardIngestionJob.objects
+                .filter(status='processing', updatedAt__lt=stale_before)
+                .update(status='pending', updatedAt=timezone.now()))
+
+    def __create_reader(self, job: CardIngestionJob):
+        image_front = job.imageFront.open('rb')
+        if job.cardType == 'healthcard':
+            return HealthCareCardReaderService(image_front, job.user)
+
+        image_back = job.imageBack.open('rb')
+        if job.cardType == 'idcard':
+            return IdCardReaderService(image_front, image_back, job.user)
+        return StudentCardReaderService(image_front, image_back, job.user)
@@ -0,0 +1,243 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from cardreader.services.tracing_service import span
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    name: str
+    help: str
+    label_names: tuple[str, ...]
+
+    def __init__(self, registry, name, help, label_names=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.label_names)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.changed()
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def render(self, snapshots):
+        totals = {}
+        for snapshot in snapshots:
+            for key, value in snapshot:
+                totals[tuple(key)] = totals.get(tuple(key), 0) + value
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in sorted(totals.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {value}')
+        return lines
+
+
+class Histogram:
+    name: str
+    help: str
+    label_names: tuple[str, ...]
+    buckets: tuple[float, ...]
+
+    def __init__(self, registry, name, help, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.label_names)
+        with self.registry.lock:
+            bucket_counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self.values[key] = (bucket_counts, total + value, count + 1)
+        self.registry.changed()
+
+    def snapshot(self):
+        return [[list(key), list(bucket_counts), total, count]
+                for key, (bucket_counts, total, count) in self.values.items()]
+
+    def render(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for key, bucket_counts, total, count in snapshot:
+                key = tuple(key)
+                previous = merged.get(key, ([0] * len(self.buckets), 0.0, 0))
+                merged[key] = ([a + b for a, b in zip(previous[0], bucket_counts)], previous[1] + total,
+                               previous[2] + count)
+
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (bucket_counts, total, count) in sorted(merged.items()):
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                labels = _labels(self.label_names + ('le',), key + (repr(bound),))
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_labels(self.label_names + ("le",), key + ("+Inf",))} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics. Every process periodically writes a snapshot into METRICS_DIR,
+    so the metrics endpoint of any web worker can report the totals of the web and job
+    worker processes together. A snapshot is deleted when its process exits; the process
+    managers also delete the ones of workers that were killed and of earlier runs.
+    """
+    DUMP_INTERVAL = 1.0
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.metrics = {}
+        self.__dump_lock = threading.Lock()
+        self.__last_dump = 0.0
+
+    def counter(self, name, help, label_names=()) -> Counter:
+        return self.metrics.setdefault(name, Counter(self, name, help, label_names))
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(self, name, help, label_names, buckets))
+
+    def changed(self):
+        if time.monotonic() - self.__last_dump >= self.DUMP_INTERVAL:
+            self.dump()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        """
+        Drops everything recorded so far, so a process about to fork does not hand its values to every child.
+        """
+        with self.lock:
+            for metric in self.metrics.values():
+                metric.values = {}
+        self.dump()
+
+    def dump(self):
+        directory = settings.METRICS_DIR
+        if not directory or not self.__dump_lock.acquire(blocking=False):
+            return
+        try:
+            self.__last_dump = time.monotonic()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(self.snapshot(), file)
+            os.replace(f'{path}.tmp', path)
+        except OSError:
+            pass
+        finally:
+            self.__dump_lock.release()
+
+    def remove(self, pid=None):
+        """
+        Deletes the snapshot of a process that exited, by default the current one, so its totals are
+        not reported forever or taken over by a new process that reuses its pid.
+        """
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        try:
+            os.remove(os.path.join(directory, f'{pid or os.getpid()}.json'))
+        except OSError:
+            pass
+
+    def remove_dead(self):
+        """
+        Deletes the snapshots of processes that are no longer running, e.g. the ones of an earlier deploy.
+        """
+        directory = settings.METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return
+        for filename in os.listdir(directory):
+            pid = filename.split('.')[0]
+            if pid.isdigit() and not _is_running(int(pid)):
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+
+    def render(self) -> str:
+        snapshots = [self.snapshot()]
+        directory = settings.METRICS_DIR
+        if directory and os.path.isdir(directory):
+            own_file = f'{os.getpid()}.json'
+            for filename in os.listdir(directory):
+                if filename.endswith('.json') and filename != own_file:
+                    try:
+                        with open(os.path.join(directory, filename)) as file:
+                            snapshots.append(json.load(file))
+                    except (OSError, ValueError):
+                        continue
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines += metric.render([snapshot.get(name, []) for snapshot in snapshots])
+        return '\n'.join(lines) + '\n'
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+registry = MetricsRegistry()
+atexit.register(registry.remove)
+
+STAGE_SECONDS = registry.histogram(
+    'cardreader_stage_seconds', 'Time spent in each stage of the card reading pipeline',
+    ('stage', 'card_type', 'field'))
+OCR_CALLS = registry.counter(
+    'cardreader_ocr_calls_total', 'OCR inference calls, by engine and whether text detection ran', ('engine', 'mode'))
+OCR_ITEMS = registry.counter(
+    'cardreader_ocr_items_total', 'Image regions sent to OCR', ('engine', 'mode'))
+THRESHOLD_RETRIES = registry.counter(
+    'cardreader_threshold_retries_total', 'Binarization thresholds stepped past before a field parsed',
+    ('card_type', 'field'))
+CACHE_LOOKUPS = registry.counter(
+    'cardreader_cache_lookups_total', 'Card read cache lookups by result', ('result',))
+
+
+@contextmanager
+def timed(stage, card_type='', field=''):
+    """
+    Records the duration of the block in STAGE_SECONDS and traces the block as a span of the
+    current request, which is yielded for adding attributes.
+    """
+    attributes = {name: value for name, value in (('card_type', card_type), ('field', field)) if value}
+    start = time.perf_counter()
+    try:
+        with span(stage, **attributes) as current:
+            yield current
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, card_type=card_type, field=field)
@@ -0,0 +1,83 @@
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from django.conf import settings
+
+from cardreader.services.tracing_service import current_request_id, span
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class OcrServerError(RuntimeError):
+    pass
+
+
+class OcrClient:
+    """
+    Sends OCR work to the run_ocr_server worker processes. The pixels are copied once into a
+    shared memory block and only its name and the image layout travel over the socket.
+    """
+    address: str
+    authkey: bytes
+    timeout: float
+
+    def __init__(self, address: str, authkey: bytes, timeout: float):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+
+    def read_batch(self, items, detail, detect):
+        return self.__call('read_batch', items, detail=detail, detect=detect)
+
+    def __call(self, op, items, **options):
+        shm = SharedMemory(create=True, size=max(sum(image.nbytes for image, _ in items), 1))
+        try:
+            layout, offset = [], 0
+            for image, allowlist_key in items:
+                image = np.ascontiguousarray(image)
+                np.ndarray(image.shape, image.dtype, buffer=shm.buf, offset=offset)[...] = image
+                layout.append((offset, image.shape, image.dtype.str, allowlist_key.name if allowlist_key else None))
+                offset += image.nbytes
+
+            with span('ocr.remote', op=op, items=len(items)), \
+                    Client(self.address, family='AF_UNIX', authkey=self.authkey) as connection:
+                connection.send({'op': op, 'shm': shm.name, 'items': layout,
+                                 'request_id': current_request_id(), **options})
+                if not connection.poll(self.timeout):
+                    raise TimeoutError("The OCR server did not answer in time")
+                status, payload = connection.recv()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if status != 'ok':
+            raise OcrServerError(payload)
+        return payload
+
+
+def attach_images(name, layout):
+    """
+    Server side: maps the client's shared memory block and returns it with views of its images.
+    Every view must be released before the block is closed.
+    """
+    shm = SharedMemory(name=name)
+    # The client owns the block and unlinks it, the server's resource tracker must not
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    images = []
+    for offset, shape, dtype, allowlist_name in layout:
+        images.append((np.ndarray(shape, np.dtype(dtype), buffer=shm.buf, offset=offset), allowlist_name))
+    return shm, images
+
+
+def get_ocr_client() -> OcrClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OcrClient(settings.OCR_SERVER_ADDRESS, settings.OCR_SERVER_AUTHKEY.encode(),
+                                    settings.OCR_SERVER_TIMEOUT)
+    return _client
@@ -0,0 +1,133 @@
+import csv
+import os
+import subprocess
+import tempfile
+import threading
+
+import cv2
+from django.conf import settings
+
+_factories = {}
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class OcrEngine:
+    """
+    Reads text from images that share an allowlist. Results follow easyocr's format: one list per
+    image of (box, text, confidence) entries, or of plain texts with detail=0, where box holds the
+    four corner points of the text line.
+    """
+
+    def read(self, images, allowlist_key=None, detail=1, detect=True) -> list:
+        raise NotImplementedError
+
+
+class TesseractEngine(OcrEngine):
+    """
+    Runs the local tesseract binary once per batch of images. Cheap on short, strictly formatted
+    fields such as digits and dates; the neural easyocr model is better at names and addresses.
+    """
+
+    def __init__(self, command=None, languages=None, timeout=None):
+        self.command = command or settings.OCR_TESSERACT_COMMAND
+        self.languages = languages or settings.OCR_TESSERACT_LANGUAGES
+        self.timeout = timeout or settings.OCR_TESSERACT_TIMEOUT
+
+    def read(self, images, allowlist_key=None, detail=1, detect=True) -> list:
+        with tempfile.TemporaryDirectory(prefix='cardreader-tesseract-') as directory:
+            paths = []
+            for i, image in enumerate(images):
+                paths.append(os.path.join(directory, f'{i}.png'))
+                cv2.imwrite(paths[-1], image)
+            image_list = os.path.join(directory, 'images.txt')
+            with open(image_list, 'w') as file:
+                file.write('\n'.join(paths) + '\n')
+
+            # psm 7 treats the image as a single text line, psm 6 as a block of lines to find
+            args = [self.command, image_list, 'stdout', '-l', self.languages, '--psm', '6' if detect else '7']
+            if allowlist_key is not None:
+                args += ['-c', f'tessedit_char_whitelist={allowlist_key.value}']
+            completed = subprocess.run(args + ['tsv'], capture_output=True, text=True, timeout=self.timeout)
+        if completed.returncode != 0:
+            raise RuntimeError(f"tesseract failed: {completed.stderr.strip()}")
+        return self.__parse(completed.stdout, len(images), detail)
+
+    @staticmethod
+    def __parse(output, count, detail):
+        # Words are merged into lines, the granularity easyocr reports and the parsers expect
+        lines = {}
+        for row in csv.DictReader(output.splitlines(), delimiter='\t', quoting=csv.QUOTE_NONE):
+            text = (row.get('text') or '').strip()
+            if row['level'] != '5' or not text or float(row['conf']) < 0:
+                continue
+            key = tuple(int(row[column]) for column in ('page_num', 'block_num', 'par_num', 'line_num'))
+            left, top = int(row['left']), int(row['top'])
+            right, bottom = left + int(row['width']), top + int(row['height'])
+            words = lines.setdefault(key, [])
+            words.append((left, top, right, bottom, text, float(row['conf']) / 100))
+
+        results = [[] for _ in range(count)]
+        for (page, *_), words in sorted(lines.items()):
+            left, top = min(word[0] for word in words), min(word[1] for word in words)
+            right, bottom = max(word[2] for word in words), max(word[3] for word in words)
+            text = ' '.join(word[4] for word in words)
+            confidence = min(word[5] for word in words)
+            box = [[left, top], [right, top], [right, bottom], [left, bottom]]
+            if 1 <= page <= count:
+                results[page - 1].append((box, text, confidence) if detail else text)
+        return results
+
+
+class StubEngine(OcrEngine):
+    """
+    Deterministic engine for tests, without any model: every image is answered with the text
+    registered for its allowlist name (or the default), boxed over the whole image with full confidence.
+    """
+
+    def __init__(self, texts=None, default=''):
+        self.texts = texts or {}
+        self.default = default
+
+    def read(self, images, allowlist_key=None, detail=1, detect=True) -> list:
+        text = self.texts.get(allowlist_key.name if allowlist_key else None, self.default)
+        results = []
+        for image in images:
+            h, w = image.shape[:2]
+            box = [[0, 0], [w, 0], [w, h], [0, h]]
+            results.append(([(box, text, 1.0)] if detail else [text]) if text else [])
+        return results
+
+
+def register_engine(name, factory):
+    """
+    Makes an engine available under a name, replacing the instance created by an earlier factory.
+    """
+    with _engines_lock:
+        _factories[name] = factory
+        _engines.pop(name, None)
+
+
+def get_engine(name) -> OcrEngine:
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                if name not in _factories:
+                    raise ValueError(f"Unknown OCR engine: {name}")
+                engine = _engines[name] = _factories[name]()
+    return engine
+
+
+def resolve_engine(engine=None) -> str:
+    """
+    Fields declare either an engine name or a kind of field ('text', 'numeric', 'mrz')
+    that OCR_FIELD_ENGINES maps to the engine of the deployment.
+    """
+    engine = engine or 'text'
+    return settings.OCR_FIELD_ENGINES.get(engine, engine)
+
+
+register_engine('tesseract', TesseractEngine)
+register_engine('stub', StubEngine)
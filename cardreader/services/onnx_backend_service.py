@@ -0,0 +1,117 @@
+import os
+
+import torch
+from django.conf import settings
+
+DETECTOR = 'detector'
+RECOGNIZER = 'recognizer'
+
+
+def model_path(directory, name, quantized=True) -> str:
+    return os.path.join(directory, f'{name}.int8.onnx' if quantized else f'{name}.onnx')
+
+
+def _unwrap(model):
+    # easyocr wraps its networks in DataParallel on GPU
+    return model.module if isinstance(model, torch.nn.DataParallel) else model
+
+
+def export_models(reader, directory, quantize=True, opset=17):
+    """
+    Exports the CRAFT detector and the recognizer of an easyocr reader to ONNX with dynamic batch
+    and image sizes, then writes int8 dynamically quantized copies next to them.
+    Returns the paths of the models OnnxDetector and OnnxRecognizer load.
+    """
+    os.makedirs(directory, exist_ok=True)
+    detector = _unwrap(reader.detector).float().cpu().eval()
+    recognizer = _unwrap(reader.recognizer).float().cpu().eval()
+
+    with torch.no_grad():
+        torch.onnx.export(
+            detector, (torch.zeros(1, 3, 640, 640),), model_path(directory, DETECTOR, quantized=False),
+            input_names=['image'], output_names=['scores', 'feature'], opset_version=opset,
+            dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'},
+                          'scores': {0: 'batch', 1: 'score_height', 2: 'score_width'},
+                          'feature': {0: 'batch', 2: 'feature_height', 3: 'feature_width'}},
+        )
+        # The recognizer takes the 64 pixel high text lines of a batch padded to a common width
+        torch.onnx.export(
+            recognizer, (torch.zeros(1, 1, 64, 256), torch.zeros(1, 26, dtype=torch.long)),
+            model_path(directory, RECOGNIZER, quantized=False),
+            input_names=['image', 'text'], output_names=['preds'], opset_version=opset,
+            dynamic_axes={'image': {0: 'batch', 3: 'width'}, 'text': {0: 'batch'},
+                          'preds': {0: 'batch', 1: 'steps'}},
+        )
+
+    if not quantize:
+        return model_path(directory, DETECTOR, quantized=False), model_path(directory, RECOGNIZER, quantized=False)
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    for name in (DETECTOR, RECOGNIZER):
+        # ConvInteger is only implemented for unsigned weights on the CPU execution provider
+        quantize_dynamic(model_path(directory, name, quantized=False), model_path(directory, name),
+                         weight_type=QuantType.QUInt8)
+    return model_path(directory, DETECTOR), model_path(directory, RECOGNIZER)
+
+
+def create_session(path, intra_threads=0, inter_threads=0):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    # 0 leaves the choice to onnxruntime, which uses every physical core
+    options.intra_op_num_threads = intra_threads
+    options.inter_op_num_threads = inter_threads
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+
+class OnnxDetector(torch.nn.Module):
+    """
+    Drop-in replacement of easyocr's CRAFT network: takes and returns torch tensors,
+    runs the exported model in onnxruntime.
+    """
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def forward(self, image):
+        scores, feature = self.session.run(None, {'image': image.cpu().numpy().astype('float32', copy=False)})
+        return torch.from_numpy(scores), torch.from_numpy(feature)
+
+
+class OnnxRecognizer(torch.nn.Module):
+    """
+    Drop-in replacement of easyocr's recognition network. The CTC model ignores the text input,
+    so it is only fed when the exported graph kept it.
+    """
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.input_names = {model_input.name for model_input in session.get_inputs()}
+
+    def forward(self, image, text=None):
+        inputs = {'image': image.cpu().numpy().astype('float32', copy=False)}
+        if 'text' in self.input_names:
+            inputs['text'] = text.cpu().numpy()
+        return torch.from_numpy(self.session.run(['preds'], inputs)[0])
+
+
+def install(reader, directory=None, quantized=None, threads=None):
+    """
+    Replaces the torch networks of an easyocr reader with the exported ONNX models.
+    threads is the (intra, inter) op thread count of the sessions, by default the OCR_ONNX_* settings.
+    """
+    directory = directory or settings.OCR_ONNX_DIR
+    quantized = settings.OCR_ONNX_QUANTIZED if quantized is None else quantized
+    paths = {name: model_path(directory, name, quantized) for name in (DETECTOR, RECOGNIZER)}
+    missing = [path for path in paths.values() if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"ONNX model missing, run the export_onnx_models command: {', '.join(missing)}")
+
+    threads = threads or (settings.OCR_ONNX_INTRA_THREADS, settings.OCR_ONNX_INTER_THREADS)
+    reader.detector = OnnxDetector(create_session(paths[DETECTOR], *threads))
+    reader.recognizer = OnnxRecognizer(create_session(paths[RECOGNIZER], *threads))
+    return reader
@@ -0,0 +1,63 @@
+import gc
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from cardreader.services.card_localization_service import RembgCardLocalizer
+from cardreader.services.metrics_service import registry
+from cardreader.services.reader_service import get_reader_pool, OcrReader
+
+logger = logging.getLogger(__name__)
+
+_torch_threads = None
+
+
+def preload_models(models=None):
+    """
+    Loads the given models, by default the ones listed in PRELOAD_MODELS, and runs one inference
+    with each, so that a process about to fork hands the loaded weights to its children as shared
+    copy-on-write pages. Call after_fork() in every child.
+    """
+    global _torch_threads
+    if models is None:
+        models = set(settings.PRELOAD_MODELS)
+        if settings.OCR_SERVER_ENABLED:
+            # The readers live in the run_ocr_server processes
+            models.discard('ocr')
+    if 'ocr' in models:
+        if settings.OCR_USE_GPU and settings.OCR_BACKEND == 'torch':
+            # A CUDA context does not survive fork, the workers load their readers themselves
+            logger.warning("Not preloading the OCR readers, OCR_USE_GPU is set")
+        elif settings.OCR_BACKEND == 'onnx' and settings.OCR_ONNX_INTRA_THREADS != 1:
+            # onnxruntime's thread pools do not survive fork either, the quantized models are
+            # small enough for every worker to load its own sessions
+            logger.warning("Not preloading the ONNX OCR readers, OCR_ONNX_INTRA_THREADS is not 1")
+        else:
+            import torch
+
+            # No OpenMP thread team may exist when the process forks, after_fork() restores the count
+            _torch_threads = torch.get_num_threads()
+            torch.set_num_threads(1)
+            get_reader_pool().warm_up()
+            blank = np.full((48, 320, 3), 255, dtype=np.uint8)
+            reader = OcrReader(remote=False)
+            # Bypasses the recognition batcher, its threads would not survive the fork
+            reader.run_inference([blank], None, 1, detect=True)
+            reader.run_inference([blank], None, 1, detect=False)
+
+    if 'rembg' in models:
+        RembgCardLocalizer().locate(np.full((64, 64, 3), 255, dtype=np.uint8))
+
+    # The warm-up inferences are not traffic
+    registry.reset()
+    # Keeps the garbage collector from writing to the preloaded objects and un-sharing their pages
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork():
+    if _torch_threads is not None:
+        import torch
+
+        torch.set_num_threads(settings.OCR_TORCH_THREADS or _torch_threads)
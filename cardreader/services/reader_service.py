@@ -1,9 +1,23 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
 from enum import Enum
+from typing import TYPE_CHECKING
 
 import cv2
-from easyocr import Reader
-from sympy import false
-from matplotlib import pyplot as plt
+import numpy as np
+from django.conf import settings
+
+from cardreader.services import debug_artifact_service
+from cardreader.services.batching_service import MicroBatcher
+from cardreader.services.metrics_service import OCR_CALLS, OCR_ITEMS
+from cardreader.services.ocr_client_service import OcrClient, get_ocr_client
+from cardreader.services.ocr_engine_service import OcrEngine, register_engine, get_engine, resolve_engine
+from cardreader.services.tracing_service import span
+
+if TYPE_CHECKING:
+    from easyocr import Reader
 
 class AllowlistOption(Enum):
     DATES = '0123456789 .'
@@ -14,24 +28,272 @@ class AllowlistOption(Enum):
     UPPERCASE_HUNGARIAN = 'ABCDEFGHIJKLMNOPQRSTUVWXYZÁÉÍÓÖŐÚÜŰ '
     BIRTHPLACE = 'ABCDEFGHIJKLMNOPQRSTUVWXYZÁÉÍÓÖŐÚÜŰ() '
 
+
+class OcrReaderPool:
+    """
+    Process-wide pool of pre-loaded easyocr readers.
+
+    Readers are created lazily up to `size` and handed out one caller at a time,
+    so the detector and recognizer weights are only loaded once per worker process.
+    With the 'onnx' backend the networks of every reader are swapped for the exported,
+    int8 quantized models running in onnxruntime on the CPU.
+    """
+    size: int
+
+    def __init__(self, size: int, languages=('hu',), gpu=True, checkout_timeout=None, backend='torch',
+                 onnx_threads=None):
+        self.size = max(1, size)
+        self.languages = list(languages)
+        self.backend = backend
+        # (intra, inter) op threads of the onnxruntime sessions, None uses the OCR_ONNX_* settings
+        self.onnx_threads = onnx_threads
+        self.gpu = gpu and backend == 'torch'
+        self.checkout_timeout = checkout_timeout
+        self.__idle = queue.Queue()
+        self.__created = 0
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def checkout(self):
+        reader = self.__acquire()
+        try:
+            yield reader
+        finally:
+            self.__idle.put(reader)
+
+    def warm_up(self):
+        """
+        Loads every reader of the pool up front instead of on first use.
+        """
+        readers = []
+        try:
+            for _ in range(self.size):
+                readers.append(self.__acquire())
+        finally:
+            for reader in readers:
+                self.__idle.put(reader)
+
+    def __acquire(self) -> 'Reader':
+        try:
+            return self.__idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.__lock:
+            can_create = self.__created < self.size
+            if can_create:
+                self.__created += 1
+
+        if can_create:
+            try:
+                # easyocr pulls in torch, so it is only imported once a pipeline needs a reader
+                from easyocr import Reader
+                reader = Reader(self.languages, gpu=self.gpu)
+                if self.backend == 'onnx':
+                    from cardreader.services import onnx_backend_service
+                    onnx_backend_service.install(reader, threads=self.onnx_threads)
+                return reader
+            except Exception:
+                with self.__lock:
+                    self.__created -= 1
+                raise
+
+        try:
+            return self.__idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError("No OCR reader became available in time")
+
+
+_reader_pool = None
+_reader_pool_lock = threading.Lock()
+
+
+def get_reader_pool() -> OcrReaderPool:
+    global _reader_pool
+    if _reader_pool is None:
+        with _reader_pool_lock:
+            if _reader_pool is None:
+                _reader_pool = OcrReaderPool(
+                    settings.OCR_READER_POOL_SIZE,
+                    gpu=settings.OCR_USE_GPU,
+                    checkout_timeout=settings.OCR_READER_CHECKOUT_TIMEOUT,
+                    backend=settings.OCR_BACKEND,
+                )
+    return _reader_pool
+
+
+class EasyOcrEngine(OcrEngine):
+    """
+    Runs easyocr on the pooled readers: text detection and recognition on images padded to a common
+    size, or with detect=False only the recognition network on already isolated text lines.
+    """
+    pool: OcrReaderPool
+
+    def __init__(self, pool: OcrReaderPool):
+        self.pool = pool
+
+    def read(self, images, allowlist_key=None, detail=1, detect=True) -> list:
+        allowlist = allowlist_key.value if allowlist_key else None
+        with self.pool.checkout() as reader:
+            if detect:
+                return reader.readtext_batched(self.__pad_to_common_size(images), detail=detail,
+                                               allowlist=allowlist, batch_size=len(images))
+            return self.__recognize(reader, images, allowlist, detail)
+
+    @staticmethod
+    def __recognize(reader, images, allowlist, detail):
+        """
+        Runs the recognizer on every image as one known text line, all lines in one batch.
+        Reader.recognize() hands the boxes to the network one at a time on the CPU, so easyocr's
+        line cropping and batched decoding are called directly instead.
+        """
+        from easyocr.config import imgH
+        from easyocr.recognition import get_text
+        from easyocr.utils import get_image_list
+
+        lines = []
+        owners = []
+        max_width = imgH
+        for index, image in enumerate(images):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            h, w = image.shape[:2]
+            image_lines, width = get_image_list([[0, w, 0, h]], [], image, model_height=imgH)
+            lines += image_lines
+            owners += [index] * len(image_lines)
+            max_width = max(max_width, width)
+
+        results = [[] for _ in images]
+        if not lines:
+            return results
+        ignore_char = ''.join(set(reader.character) - set(allowlist or reader.lang_char))
+        recognized = get_text(reader.character, imgH, int(max_width), reader.recognizer, reader.converter, lines,
+                              ignore_char=ignore_char, batch_size=len(lines), workers=0, device=reader.device)
+        for index, (box, text, prob) in zip(owners, recognized):
+            if text:
+                results[index].append((box, text, prob) if detail else text)
+        return results
+
+    @staticmethod
+    def __pad_to_common_size(images):
+        images = [cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if image.ndim == 2 else image for image in images]
+        height = max(image.shape[0] for image in images)
+        width = max(image.shape[1] for image in images)
+        padded = []
+        for image in images:
+            h, w = image.shape[:2]
+            padded.append(cv2.copyMakeBorder(image, 0, height - h, 0, width - w, cv2.BORDER_CONSTANT,
+                                             value=(255, 255, 255)))
+        return np.stack(padded)
+
+
+register_engine('easyocr', lambda: EasyOcrEngine(get_reader_pool()))
+
+
 class OcrReader:
-    reader:Reader
+    client: OcrClient | None
 
-    def __init__(self, preprocess= false):
-        self.reader = Reader(['hu'], gpu=True)
+    def __init__(self, preprocess=False, remote=None):
+        """
+        With remote (by default OCR_SERVER_ENABLED) the easyocr reads are sent to the run_ocr_server
+        worker processes instead of running on this process' reader pool.
+        """
+        remote = settings.OCR_SERVER_ENABLED if remote is None else remote
+        self.client = get_ocr_client() if remote else None
         self.preprocess = preprocess
 
-    def read(self, image, detail=1, show_image=False, allowlist_key: AllowlistOption = None):
-        if show_image:
-            self.__imshow(image)
+    def read(self, image, detail=1, allowlist_key: AllowlistOption = None, detect=True, engine=None):
+        return self.read_batch([(image, allowlist_key, engine)], detail=detail, detect=detect)[0]
 
-        allowlist = allowlist_key.value if allowlist_key else None
+    def read_batch(self, items, detail=1, detect=True):
+        """
+        Reads a list of (image, allowlist_key) or (image, allowlist_key, engine) items in as few
+        inference calls as possible. The engine is an engine name or a kind of field resolved
+        through OCR_FIELD_ENGINES, plain text by default.
+        With detect=False every image is treated as a single, already isolated text line and
+        only the recognition network runs; otherwise items sharing an engine and allowlist are
+        padded to a common size and run through text detection and recognition together.
+        Results are returned in the order of the items.
+        """
+        detect = detect or not settings.OCR_RECOGNIZER_ONLY_ROIS
+        mode = 'detect' if detect else 'recognize'
+        results = [[] for _ in items]
+        groups = {}
+        for index, (image, allowlist_key, *engine) in enumerate(items):
+            if image.size:
+                groups.setdefault((resolve_engine(engine[0] if engine else None), allowlist_key), []).append(index)
+
+        if self.client is not None:
+            remote = [index for (engine, _), indexes in groups.items() if engine == 'easyocr' for index in indexes]
+            if remote:
+                remote_results = self.client.read_batch([items[index][:2] for index in remote], detail, detect)
+                for index, result in zip(remote, remote_results):
+                    results[index] = result
+            groups = {key: indexes for key, indexes in groups.items() if key[0] != 'easyocr'}
+
+        # Recognizer-only easyocr reads are queued together with the ones of concurrent requests
+        batcher = get_recognition_batcher() if not detect and settings.OCR_BATCH_MAX_WAIT_MS > 0 else None
+        futures = {}
+        if batcher is not None:
+            for (engine, allowlist_key), indexes in groups.items():
+                if engine == 'easyocr':
+                    futures[allowlist_key] = batcher.submit((allowlist_key, detail),
+                                                            [items[index][0] for index in indexes])
+
+        for (engine, allowlist_key), indexes in groups.items():
+            images = [items[index][0] for index in indexes]
+            with span(f'ocr.{mode}', engine=engine, items=len(images),
+                      allowlist=allowlist_key.name if allowlist_key else None) as current:
+                if engine == 'easyocr' and allowlist_key in futures:
+                    batch_results, batch_items = futures[allowlist_key].result()
+                    current.set_attribute('batch_items', batch_items)
+                else:
+                    batch_results = self.run_inference(images, allowlist_key, detail, detect, engine)
+                self.__trace_results(current, batch_results)
+            for index, result in zip(indexes, batch_results):
+                results[index] = result
+                debug_artifact_service.save_ocr(items[index][0], result)
+        return results
+
+    def run_inference(self, images, allowlist_key, detail, detect, engine='easyocr'):
+        """
+        Runs one inference call of the engine on the images, which all share the allowlist.
+        """
+        mode = 'detect' if detect else 'recognize'
+        OCR_CALLS.inc(engine=engine, mode=mode)
+        OCR_ITEMS.inc(len(images), engine=engine, mode=mode)
+        return get_engine(engine).read(images, allowlist_key, detail, detect)
+
+    @staticmethod
+    def __trace_results(current, results):
+        # Mean confidence of every image's text boxes, only available with detail=1
+        confidences = []
+        for result in results:
+            probs = [float(item[2]) for item in result if isinstance(item, (tuple, list))]
+            confidences.append(round(sum(probs) / len(probs), 4) if probs else None)
+        current.set_attribute('confidences', confidences)
+        if settings.TRACING_INCLUDE_TEXT:
+            current.set_attribute('texts', [[item[1] if isinstance(item, (tuple, list)) else item for item in result]
+                                            for result in results])
+
+
+_recognition_batcher = None
+_recognition_batcher_pid = None
+_recognition_batcher_lock = threading.Lock()
 
-        return self.reader.readtext(image, detail=detail, allowlist=allowlist)
 
-    def __imshow(self,  image, size= 10):
-        h, w = image.shape[0], image.shape[1]
-        aspect_ratio = w / h
-        plt.figure(figsize=(size * aspect_ratio, size))
-        plt.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        plt.show()
\ No newline at end of file
+def get_recognition_batcher() -> MicroBatcher:
+    global _recognition_batcher, _recognition_batcher_pid
+    # Dispatcher threads do not survive fork, a forked child needs its own batcher
+    if _recognition_batcher_pid != os.getpid():
+        with _recognition_batcher_lock:
+            if _recognition_batcher_pid != os.getpid():
+                reader = OcrReader(remote=False)
+                _recognition_batcher = MicroBatcher(
+                    lambda key, images: reader.run_inference(images, key[0], key[1], detect=False),
+                    settings.OCR_BATCH_MAX_ITEMS,
+                    settings.OCR_BATCH_MAX_WAIT_MS / 1000,
+                    dispatchers=settings.OCR_READER_POOL_SIZE,
+                    name='ocr-batcher',
+                )
+                _recognition_batcher_pid = os.getpid()
+    return _recognition_batcher
@@ -1,15 +1,18 @@
 from datetime import datetime
 
 import numpy as np
+from django.conf import settings
 from django.core.files import File
-from django.db.models.expressions import result
-from tifffile import imshow
 
 from cardreader.dtos.student_card_dto import StudentCardData
 from cardreader.models import User, StudentCard
+from cardreader.services.card_cache_service import CardCacheService
 from cardreader.services.converter_service import ConverterService
+from cardreader.services import debug_artifact_service
 from cardreader.services.data_processor_service import DataProcessorService
+from cardreader.services.executor_service import run_concurrently
 from cardreader.services.image_processing_service import ImageProcessingService
+from cardreader.services.metrics_service import timed, THRESHOLD_RETRIES
 from cardreader.services.reader_service import OcrReader, AllowlistOption
 
 
@@ -18,6 +21,7 @@ class StudentCardReaderService:
     image_file_back: File
     image_front: np.ndarray
     image_back: np.ndarray
+    images: dict
     user: User
     cardData: StudentCardData
     reader: OcrReader
@@ -32,18 +36,33 @@ class StudentCardReaderService:
         self.processing_service = ImageProcessingService()
         self.converterService = ConverterService()
         self.dataProcessorService = DataProcessorService()
+        self.cacheService = CardCacheService()
 
     def read_data(self):
+        cache_key = self.cacheService.key('studentcard', self.image_file_front, self.image_file_back)
+        cached = self.cacheService.get_card(cache_key, StudentCard, self.user)
+        if cached is not None:
+            card, self.images = cached
+            return card
+
         self.remove_backgrounds()
-        self.read_front()
-        self.read_back()
-        return self.create_model()
+        run_concurrently(self.read_front, self.read_back)
+        card = self.create_model()
+        self.images = {'imageFront': self.image_front, 'imageBack': self.image_back}
+        self.cacheService.put_card(cache_key, 'studentcard', card, self.images)
+        return card
 
     def remove_backgrounds(self):
-        self.image_front = self.processing_service.remove_background(self.converterService.file_to_numpy(self.image_file_front))
-        self.image_back = self.processing_service.remove_background(self.converterService.file_to_numpy(self.image_file_back))
-        self.image_file_front = self.converterService.numpy_to_file(self.image_front)
-        self.image_file_back = self.converterService.numpy_to_file(self.image_back)
+        self.image_front, self.image_back = run_concurrently(
+            lambda: self.__extract_card(self.image_file_front, 'front'),
+            lambda: self.__extract_card(self.image_file_back, 'back'),
+        )
+
+    def __extract_card(self, image_file, side):
+        with timed('decode', 'studentcard', side):
+            image = self.converterService.file_to_numpy(image_file, settings.CARD_DECODE_MAX_SIDES['studentcard'])
+        with timed('remove_background', 'studentcard', side):
+            return self.processing_service.extract_card(image, 'studentcard')
 
     def read_front(self):
         self.read_name()
@@ -53,16 +72,12 @@ class StudentCardReaderService:
 
     def read_back(self):
         self.read_issue_date()
-        self.read_expiry_year()
-        self.read_school()
         self.read_address()
-        self.read_sticker()
+        self.read_printed_fields()
 
     def create_model(self) -> StudentCard:
         return StudentCard(
             user=self.user,
-            imageFront=self.image_file_front,
-            imageBack=self.image_file_back,
             name=self.cardData.name,
             birthDate=self.cardData.birth_date,
             issueDate=self.cardData.issue_date,
@@ -77,116 +92,130 @@ class StudentCardReaderService:
     # def read_name(self):
     #     image = self.processing_service.crop_image(self.image_front, (0.2, 0.4), (0.26, 0.65))
     #     #image = self.processing_service.preprocess_image(image, ksize=9, treshold=70)
-    #     result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
+    #     result = self.reader.read(image, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
     #     self.cardData.name = self.dataProcessorService.process_name(result)
     #     print(result)
 
     def read_name(self):
         cropped_image = self.processing_service.crop_image(self.image_front, (0.2, 0.4), (0.26, 0.65))
-        name = ''
-        treshold = 70
-        processed_image = []
-        result = []
-        while (name == '' or name is None) and treshold < 150:
-            processed_image = self.processing_service.preprocess_image(cropped_image, ksize=9, treshold=treshold)
-            result = self.reader.read(processed_image, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
-            name = self.dataProcessorService.process_name(result)
-            treshold = treshold + 20
-        self.processing_service.imshow(processed_image)
+        variants = self.processing_service.preprocess_image_variants(cropped_image, ksize=9, tresholds=range(70, 150, 20))
+        name, result, processed_image, _ = self.__sweep_tresholds(
+            'name', variants, AllowlistOption.UPPERCASE_HUNGARIAN, self.dataProcessorService.process_name)
+        debug_artifact_service.save_image('threshold', processed_image)
         self.cardData.name = name
-        print(result)
 
     def read_birth_date_and_place(self):
         cropped_image = self.processing_service.crop_image(self.image_front, (0.40, 0.52), (0.25, 0.67))
-        birthdate = ''
-        treshold = 55
-        processed_image=[]
-        result = []
-        while (birthdate == '' or birthdate is None) and treshold < 150:
-            processed_image = self.processing_service.preprocess_image(cropped_image, ksize=9, treshold=treshold)
-            result = self.reader.read(processed_image, allowlist_key=AllowlistOption.DATES)
-            birthdate = self.dataProcessorService.process_date(result)
-            treshold += 10
-        self.processing_service.imshow(processed_image)
+        tresholds = range(55, 150, 10)
+        variants = self.processing_service.preprocess_image_variants(cropped_image, ksize=9, tresholds=tresholds)
+        birthdate, result, processed_image, index = self.__sweep_tresholds(
+            'birth_date', variants, AllowlistOption.DATES, self.dataProcessorService.process_date, engine='numeric',
+            detect=False)
+        debug_artifact_service.save_image('threshold', processed_image)
         self.cardData.birth_date = birthdate
-        print(result)
 
         image = self.processing_service.crop_image(self.image_front, (0.45, 0.55), (0.27, 0.7))
-        image = self.processing_service.preprocess_image(image, ksize=9, treshold=treshold)
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
+        image = self.processing_service.preprocess_image(image, ksize=9, treshold=tresholds[index] + 10)
+        with timed('ocr', 'studentcard', 'place_of_birth'):
+            result = self.reader.read(image, allowlist_key=AllowlistOption.UPPERCASE_HUNGARIAN)
         self.cardData.place_of_birth = self.dataProcessorService.process_birthplace(result)
-        print(result)
 
 
     def read_OM(self):
         cropped_image = self.processing_service.crop_image(self.image_front, (0.63, 0.8), (0.27, 0.6))
-        result = []
-        om_number = ''
-        processed_image=[]
-        treshold = 60
-        while om_number == '' or om_number is None and treshold < 150:
-            processed_image = self.processing_service.preprocess_image(cropped_image, ksize=9, treshold=treshold)
-            result = self.reader.read(processed_image, allowlist_key=AllowlistOption.NUMBERS_ONLY)
-            om_number = self.dataProcessorService.process_numeric_identifier(result, '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]')
-            treshold += 10
-        self.processing_service.imshow(processed_image)
+        variants = self.processing_service.preprocess_image_variants(cropped_image, ksize=9, tresholds=range(60, 150, 10))
+        om_number, result, processed_image, _ = self.__sweep_tresholds(
+            'OM_number', variants, AllowlistOption.NUMBERS_ONLY,
+            lambda result: self.dataProcessorService.process_numeric_identifier(result, '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]'),
+            engine='numeric', detect=False)
+        debug_artifact_service.save_image('threshold', processed_image)
         self.cardData.OM_number= om_number
-        print(result)
 
     def read_card_number(self):
         image = self.processing_service.crop_image(self.image_front, (0.0, 0.2), (0.63, 1.0))
         image = self.processing_service.preprocess_image(image, ksize=5, treshold=100)
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.NUMBERS_ONLY)
+        with timed('ocr', 'studentcard', 'card_number'):
+            result = self.reader.read(image, allowlist_key=AllowlistOption.NUMBERS_ONLY, detect=False, engine='numeric')
         self.cardData.card_number = self.dataProcessorService.process_numeric_identifier(result, '[0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9][0-9]')
-        print(result)
 
     def read_address(self):
         cropped_image = self.processing_service.crop_image(self.image_back, (0.593, 0.72), (0.05, 0.6))
-        treshold = 60
-        result = []
-        address = ''
-        processed_image =[]
-        while address == '' and treshold < 150:
-            processed_image = self.processing_service.preprocess_image(cropped_image, ksize=9, treshold=treshold)
-            result = self.reader.read(processed_image, allowlist_key=AllowlistOption.HUNGARIAN_ALPHANUMERIC)
-            address = self.dataProcessorService.process_address(result)
-            treshold = treshold + 10
-        self.processing_service.imshow(processed_image)
+        variants = self.processing_service.preprocess_image_variants(cropped_image, ksize=9, tresholds=range(60, 150, 10))
+        address, result, processed_image, _ = self.__sweep_tresholds(
+            'address', variants, AllowlistOption.HUNGARIAN_ALPHANUMERIC, self.dataProcessorService.process_address)
+        debug_artifact_service.save_image('threshold', processed_image)
         self.cardData.address = address
-        print(result)
 
     def read_issue_date(self):
         cropped_image = self.processing_service.crop_image(self.image_back, (0.15, 0.28), (0.48, 0.71))
-        treshold = 55
-        result = []
-        issue_date = ''
-        processed_image =[]
-        while issue_date == '' or issue_date is None and treshold<150:
-            processed_image = self.processing_service.preprocess_image(cropped_image, ksize=11, treshold=treshold)
-            result = self.reader.read(processed_image, allowlist_key=AllowlistOption.DATES)
-            issue_date = self.dataProcessorService.process_date(result, accuracy_treshold=0.25)
-            treshold = treshold + 10
-        self.processing_service.imshow(processed_image)
+        variants = self.processing_service.preprocess_image_variants(cropped_image, ksize=11, tresholds=range(55, 150, 10))
+        issue_date, result, processed_image, _ = self.__sweep_tresholds(
+            'issue_date', variants, AllowlistOption.DATES,
+            lambda result: self.dataProcessorService.process_date(result, accuracy_threshold=0.25), engine='numeric',
+            detect=False)
+        debug_artifact_service.save_image('threshold', processed_image)
         self.cardData.issue_date = issue_date
-        print(result)
-
-    def read_expiry_year(self):
-        image = self.processing_service.crop_image(self.image_back, (0.28, 0.4), (0.48, 0.68))
-        image = self.processing_service.preprocess_image(image, ksize=7, treshold=65)
-        result = self.reader.read(image, show_image=True, allowlist_key=AllowlistOption.NUMBERS_ONLY)
-        self.cardData.expiry_year = self.dataProcessorService.process_year(result)
-        print(result)
-
-    def read_school(self):
-        image = self.processing_service.crop_image(self.image_back, (0.43, 0.54), (0.0, 0.8))
-        image = self.processing_service.preprocess_image(image, ksize=7, treshold=120, otsu=True)
-        result = self.reader.read(image, show_image=True)
-        self.cardData.school = self.dataProcessorService.process_school(result)
-        print(result)
-
-    def read_sticker(self):
-        image = self.processing_service.crop_image(self.image_back, (0.69, 0.95), (0.75, 1))
-        #image = self.processing_service.preprocess_image(image, ksize=9, treshold=80)
-        result = self.reader.read(image, show_image=True)
-        self.cardData.expiry_sticker = self.dataProcessorService.process_sticker(result)
-        print(result)
\ No newline at end of file
+
+    def read_printed_fields(self):
+        crop = self.processing_service.crop_image
+        preprocess = self.processing_service.preprocess_image
+        with timed('ocr', 'studentcard', 'expiry_year'):
+            expiry_year = self.reader.read(preprocess(crop(self.image_back, (0.28, 0.4), (0.48, 0.68)), ksize=7, treshold=65),
+                                           allowlist_key=AllowlistOption.NUMBERS_ONLY, detect=False, engine='numeric')
+        with timed('ocr', 'studentcard', 'printed_fields'):
+            school, sticker = self.reader.read_batch([
+                (preprocess(crop(self.image_back, (0.43, 0.54), (0.0, 0.8)), ksize=7, treshold=120, otsu=True), None),
+                (crop(self.image_back, (0.69, 0.95), (0.75, 1)), None),
+            ])
+        with timed('parse', 'studentcard', 'printed_fields'):
+            self.cardData.expiry_year = self.dataProcessorService.process_year(expiry_year)
+            self.cardData.school = self.dataProcessorService.process_school(school)
+            self.cardData.expiry_sticker = self.dataProcessorService.process_sticker(sticker)
+
+    def __sweep_tresholds(self, field, variants, allowlist_key, parse, engine=None, detect=True):
+        """
+        Picks the binarized variant to read a field from. Returns the value, the raw OCR result,
+        the variant used and its index, which the span records as the chosen threshold.
+        Single-line fields pass detect=False, so a batch sweep costs one recognizer-only call
+        instead of a text detection pass per variant.
+        """
+        sequential = settings.THRESHOLD_SWEEP_MODE == 'sequential'
+        with timed('ocr', 'studentcard', field) as current:
+            if sequential:
+                swept = self.__read_until_parsed(variants, allowlist_key, parse, engine, detect)
+            else:
+                swept = self.__read_most_confident(variants, allowlist_key, parse, engine, detect)
+            current.set_attribute('variant', swept[3])
+            current.set_attribute('parsed', bool(swept[0]))
+            if sequential:
+                # A batch sweep reads every variant exactly once, only the early-exit loop retries
+                current.set_attribute('retries', swept[3])
+        if sequential:
+            THRESHOLD_RETRIES.inc(swept[3], card_type='studentcard', field=field)
+        return swept
+
+    def __read_until_parsed(self, variants, allowlist_key, parse, engine, detect):
+        value, result, index = '', [], 0
+        for index, processed_image in enumerate(variants):
+            result = self.reader.read(processed_image, allowlist_key=allowlist_key, detect=detect, engine=engine)
+            value = parse(result)
+            if value:
+                break
+        return value, result, variants[index], index
+
+    def __read_most_confident(self, variants, allowlist_key, parse, engine, detect):
+        # Every variant is read in one batch, the parsable result with the best mean confidence wins
+        results = self.reader.read_batch([(variant, allowlist_key, engine) for variant in variants], detect=detect)
+        best, best_confidence = None, -1.0
+        for index, result in enumerate(results):
+            value = parse(result)
+            if not value:
+                continue
+            confidence = sum(prob for (bbox, text, prob) in result) / len(result)
+            if confidence > best_confidence:
+                best, best_confidence = (value, result, variants[index], index), confidence
+
+        if best is None:
+            index = len(variants) - 1
+            return parse(results[index]), results[index], variants[index], index
+        return best
@@ -0,0 +1,88 @@
+import json
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger('cardreader.tracing')
+
+_current_span = ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    One timed step of handling a request. Spans of the same request share its request id,
+    and each span points to the span that was current when it was started.
+    """
+    name: str
+    request_id: str
+    span_id: str
+    parent_id: str | None
+    attributes: dict
+
+    def __init__(self, name, request_id, parent_id=None, attributes=None):
+        self.name = name
+        self.request_id = request_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'requestId': self.request_id,
+            'spanId': self.span_id,
+            'parentId': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'durationMs': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'attributes': self.attributes,
+        }
+
+
+@contextmanager
+def span(name, request_id=None, **attributes):
+    """
+    Starts a child of the current span, or a new trace if there is none. The span is
+    written to the 'cardreader.tracing' logger as a JSON line when the block exits.
+    """
+    parent = _current_span.get()
+    if request_id is None:
+        request_id = parent.request_id if parent is not None else new_request_id()
+    current = Span(name, request_id, parent.span_id if parent is not None else None, attributes)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception as err:
+        current.set_attribute('error', repr(err))
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        export(current)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def current_request_id() -> str | None:
+    current = _current_span.get()
+    return current.request_id if current is not None else None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def export(finished: Span):
+    if settings.TRACING_ENABLED and logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(finished.to_dict(), default=str))
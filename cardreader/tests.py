@@ -1,3 +1,524 @@
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from cardreader.api import idempotency
+from cardreader.api.idempotency import idempotent
+from cardreader.api.views import metrics_view
+from cardreader.models import CardIngestionJob, CardReadCache, HealthCareCard, IdempotencyRecord, StudentCard, User
+from cardreader.services import card_cache_service
+from cardreader.services.batching_service import MicroBatcher
+from cardreader.services.card_cache_service import CachedCardRead, CardCacheService
+from cardreader.services.card_localization_service import ContourCardLocalizer, ID1_ASPECT_RATIO, order_quad
+from cardreader.services.converter_service import ConverterService
+from cardreader.services.image_processing_service import ImageProcessingService
+from cardreader.services.image_storage_service import EncodedImage
+from cardreader.services.ingestion_job_service import IngestionJobService
+from cardreader.services.ocr_engine_service import StubEngine, TesseractEngine, register_engine, resolve_engine
+from cardreader.services.reader_service import AllowlistOption, EasyOcrEngine, OcrReader
+from cardreader.services.studentcard_reader_service import StudentCardReaderService
+
+register_engine('test-text', lambda: StubEngine(default='KOVACS ANNA'))
+register_engine('test-numeric', lambda: StubEngine(texts={'DATES': '2001.02.03'}, default='123456'))
+
+TEST_ENGINES = {'text': 'test-text', 'numeric': 'test-numeric', 'mrz': 'test-text'}
+
+
+def blank(h=20, w=80):
+    return np.full((h, w, 3), 255, dtype=np.uint8)
+
+
+@override_settings(OCR_FIELD_ENGINES=TEST_ENGINES, OCR_BATCH_MAX_WAIT_MS=0)
+class OcrReaderRoutingTests(SimpleTestCase):
+    def test_read_batch_groups_items_by_engine_and_allowlist(self):
+        items = [
+            (blank(), None),
+            (blank(), AllowlistOption.DATES, 'numeric'),
+            (blank(), None, 'numeric'),
+            (np.zeros((0, 0, 3), dtype=np.uint8), None),
+            (blank(30, 120), AllowlistOption.DATES, 'numeric'),
+        ]
+        with mock.patch.object(OcrReader, 'run_inference', autospec=True,
+                               side_effect=OcrReader.run_inference) as run_inference:
+            results = OcrReader(remote=False).read_batch(items, detail=0)
+
+        self.assertEqual(results, [['KOVACS ANNA'], ['2001.02.03'], ['123456'], [], ['2001.02.03']])
+        # Called with (self, images, allowlist_key, detail, detect, engine)
+        groups = sorted((call.args[5], call.args[2].name if call.args[2] else '', len(call.args[1]))
+                        for call in run_inference.call_args_list)
+        self.assertEqual(groups, [('test-numeric', '', 1), ('test-numeric', 'DATES', 2), ('test-text', '', 1)])
+
+    def test_read_routes_the_declared_kind_of_field(self):
+        reader = OcrReader(remote=False)
+
+        self.assertEqual(reader.read(blank(), detail=0, engine='numeric'), ['123456'])
+        self.assertEqual(reader.read(blank(), detail=0, engine='mrz'), ['KOVACS ANNA'])
+        self.assertEqual(reader.read(blank(), detail=0), ['KOVACS ANNA'])
+
+    def test_results_keep_easyocr_format_with_detail(self):
+        [[(box, text, confidence)]] = OcrReader(remote=False).read_batch([(blank(20, 80), None)])
+
+        self.assertEqual(box, [[0, 0], [80, 0], [80, 20], [0, 20]])
+        self.assertEqual((text, confidence), ('KOVACS ANNA', 1.0))
+
+    def test_engine_names_resolve_to_themselves(self):
+        self.assertEqual(resolve_engine('numeric'), 'test-numeric')
+        self.assertEqual(resolve_engine(None), 'test-text')
+        self.assertEqual(resolve_engine('tesseract'), 'tesseract')
+
+    @override_settings(OCR_FIELD_ENGINES={**TEST_ENGINES, 'text': 'easyocr'})
+    def test_only_easyocr_reads_are_sent_to_the_ocr_server(self):
+        reader = OcrReader(remote=False)
+        reader.client = mock.Mock()
+        reader.client.read_batch.return_value = [['REMOTE']]
+
+        results = reader.read_batch([(blank(), None), (blank(), None, 'numeric')], detail=0)
+
+        self.assertEqual(results, [['REMOTE'], ['123456']])
+        remote_items = reader.client.read_batch.call_args.args[0]
+        self.assertEqual(len(remote_items), 1)
+        self.assertIsNone(remote_items[0][1])
+
+
+class TesseractParseTests(SimpleTestCase):
+    HEADER = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
+
+    def parse(self, rows, count=1, detail=1):
+        output = '\n'.join([self.HEADER] + ['\t'.join(str(value) for value in row) for row in rows])
+        return TesseractEngine._TesseractEngine__parse(output, count, detail)
+
+    def test_merges_words_into_lines(self):
+        results = self.parse([
+            (1, 1, 0, 0, 0, 0, 0, 0, 200, 50, -1, ''),
+            (4, 1, 1, 1, 1, 0, 10, 5, 120, 20, -1, ''),
+            (5, 1, 1, 1, 1, 1, 10, 5, 50, 20, 96, 'KOVACS'),
+            (5, 1, 1, 1, 1, 2, 70, 6, 60, 19, 90, 'ANNA'),
+        ])
+
+        self.assertEqual(results, [[([[10, 5], [130, 5], [130, 25], [10, 25]], 'KOVACS ANNA', 0.9)]])
+
+    def test_orders_lines_numerically_and_splits_pages(self):
+        rows = [(5, 1, block, 1, 1, 1, 0, block * 10, 10, 10, 90, f'block{block}') for block in (10, 2, 1)]
+        rows.append((5, 2, 1, 1, 1, 1, 0, 0, 10, 10, 80, 'second'))
+
+        self.assertEqual(self.parse(rows, count=2, detail=0), [['block1', 'block2', 'block10'], ['second']])
+
+    def test_skips_empty_and_unrecognized_words(self):
+        results = self.parse([
+            (5, 1, 1, 1, 1, 1, 0, 0, 10, 10, -1, 'x'),
+            (5, 1, 1, 1, 1, 2, 0, 0, 10, 10, 80, ' '),
+        ], count=2)
+
+        self.assertEqual(results, [[], []])
+
+
+class ThresholdSweepTests(SimpleTestCase):
+    BOX = [[0, 0], [10, 0], [10, 10], [0, 10]]
+
+    def sweep(self, texts_and_confidences):
+        service = StudentCardReaderService.__new__(StudentCardReaderService)
+        service.reader = mock.Mock()
+        service.reader.read_batch.return_value = [[(self.BOX, text, confidence)]
+                                                  for text, confidence in texts_and_confidences]
+        variants = [np.full((2, 2), i, dtype=np.uint8) for i in range(len(texts_and_confidences))]
+        parse = lambda result: ''.join(text for _, text, _ in result if text.isdigit())
+        swept = service._StudentCardReaderService__read_most_confident(variants, AllowlistOption.NUMBERS_ONLY,
+                                                                       parse, 'numeric', False)
+        return service, swept
+
+    def test_the_most_confident_parsable_variant_wins(self):
+        service, (value, result, variant, index) = self.sweep([('12a', 0.99), ('123', 0.6), ('456', 0.8), ('x', 0.9)])
+
+        self.assertEqual((value, index), ('456', 2))
+        self.assertEqual(variant[0, 0], 2)
+        self.assertEqual(service.reader.read_batch.call_args.kwargs['detect'], False)
+        self.assertEqual(len(service.reader.read_batch.call_args.args[0]), 4)
+
+    def test_falls_back_to_the_last_variant(self):
+        _, (value, result, variant, index) = self.sweep([('a', 0.9), ('b', 0.95), ('c', 0.5)])
+
+        self.assertEqual((value, index), ('', 2))
+        self.assertEqual(result, [(self.BOX, 'c', 0.5)])
+
+
+@override_settings(CARD_JOB_STALE_AFTER=60)
+class IngestionJobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create(email='jobs@example.com')
+        self.service = IngestionJobService()
+
+    def job(self, status='pending', age=0):
+        job = self.service.submit('studentcard', self.user,
+                                  SimpleUploadedFile('front.jpg', b'front'), SimpleUploadedFile('back.jpg', b'back'))
+        # Queryset updates skip auto_now, so the timestamps stay as given
+        then = timezone.now() - timedelta(seconds=age)
+        CardIngestionJob.objects.filter(pk=job.pk).update(status=status, createdAt=then, updatedAt=then)
+        job.refresh_from_db()
+        return job
+
+    def process(self, job, reader):
+        uploads = [job.imageFront.path, job.imageBack.path]
+        with mock.patch.object(IngestionJobService, '_IngestionJobService__create_reader', return_value=reader), \
+                mock.patch.object(self.service.storageService, 'save_card_images') as save_card_images:
+            self.service.process(job)
+        job.refresh_from_db()
+        self.assertFalse(any(os.path.exists(path) for path in uploads))
+        self.assertFalse(job.imageFront or job.imageBack)
+        return save_card_images
+
+    def test_claims_the_oldest_pending_job(self):
+        self.job('processing', age=300)
+        newer, older = self.job(age=10), self.job(age=100)
+
+        claimed = self.service.claim_next()
+        self.assertEqual(claimed, older)
+        self.assertEqual(CardIngestionJob.objects.get(pk=older.pk).status, 'processing')
+        self.assertEqual(self.service.claim_next(), newer)
+        self.assertIsNone(self.service.claim_next())
+
+    def test_stores_the_card_and_deletes_the_uploads(self):
+        job = self.job('processing')
+        card = StudentCard(user=self.user, name='KOVACS ANNA')
+        reader = mock.Mock(images=['front', 'back'])
+        reader.read_data.return_value = card
+
+        save_card_images = self.process(job, reader)
+
+        self.assertEqual((job.status, job.studentCard, job.error), ('done', card, ''))
+        save_card_images.assert_called_once_with(card, ['front', 'back'])
+
+    def test_failed_reads_store_a_generic_error_and_delete_the_uploads(self):
+        job = self.job('processing')
+        reader = mock.Mock()
+        reader.read_data.side_effect = ValueError('/srv/media/jobs/front.jpg is blurry')
+
+        with self.assertLogs('cardreader.services.ingestion_job_service', 'ERROR'):
+            save_card_images = self.process(job, reader)
+
+        self.assertEqual((job.status, job.error), ('failed', 'The card could not be read'))
+        self.assertIsNone(job.card)
+        save_card_images.assert_not_called()
+
+    def test_requeues_only_stale_processing_jobs(self):
+        stale, running = self.job('processing', age=120), self.job('processing', age=10)
+        done = self.job('done', age=120)
+
+        self.assertEqual(self.service.requeue_stale(), 1)
+        statuses = dict(CardIngestionJob.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {stale.pk: 'pending', running.pk: 'processing', done.pk: 'done'})
+
+
+class CardLocalizationTests(SimpleTestCase):
+    def test_order_quad(self):
+        quad = order_quad([[100, 90], [0, 0], [0, 100], [110, 5]])
+
+        self.assertEqual(quad.tolist(), [[0, 0], [110, 5], [100, 90], [0, 100]])
+
+    def test_contour_localizer_finds_an_id1_card(self):
+        image = np.full((900, 1200, 3), 40, dtype=np.uint8)
+        corners = cv2.boxPoints(((600, 450), (856, 856 / ID1_ASPECT_RATIO), 4))
+        cv2.fillPoly(image, [corners.astype(np.int32)], (220, 220, 220))
+
+        location = ContourCardLocalizer().locate(image)
+
+        self.assertIsNotNone(location)
+        self.assertGreater(location.confidence, 0.8)
+        np.testing.assert_allclose(location.quad, order_quad(corners), atol=15)
+
+    def test_contour_localizer_gives_up_without_a_card(self):
+        self.assertIsNone(ContourCardLocalizer().locate(np.full((600, 800, 3), 128, dtype=np.uint8)))
+
+
+def jpeg_header(width, height):
+    app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = b'\xff\xc0\x00\x11\x08' + height.to_bytes(2, 'big') + width.to_bytes(2, 'big') + b'\x03' + b'\x00' * 9
+    return np.frombuffer(b'\xff\xd8' + app0 + sof0 + b'\x00' * 16, np.uint8)
+
+
+class ConverterDecodeTests(SimpleTestCase):
+    def test_reads_the_jpeg_size_from_the_frame_header(self):
+        self.assertEqual(ConverterService._ConverterService__jpeg_size(jpeg_header(4032, 3024)), (4032, 3024))
+
+    def test_jpeg_size_is_none_for_other_formats(self):
+        png = np.frombuffer(b'\x89PNG\r\n\x1a\n' + b'\x00' * 32, np.uint8)
+
+        self.assertIsNone(ConverterService._ConverterService__jpeg_size(png))
+
+    def test_jpeg_size_matches_an_encoded_image(self):
+        _, encoded = cv2.imencode('.jpeg', np.zeros((30, 50, 3), dtype=np.uint8))
+
+        self.assertEqual(ConverterService._ConverterService__jpeg_size(encoded.ravel()), (50, 30))
+
+    def test_decode_flag_picks_the_scale_nearest_max_side(self):
+        decode_flag = ConverterService()._ConverterService__decode_flag
+
+        self.assertEqual(decode_flag(jpeg_header(4000, 3000), 2400), cv2.IMREAD_REDUCED_COLOR_2)
+        self.assertEqual(decode_flag(jpeg_header(4032, 3024), 2400), cv2.IMREAD_REDUCED_COLOR_2)
+        self.assertEqual(decode_flag(jpeg_header(8000, 6000), 2400), cv2.IMREAD_REDUCED_COLOR_4)
+        self.assertEqual(decode_flag(jpeg_header(3000, 2000), 2400), cv2.IMREAD_COLOR)
+        self.assertEqual(decode_flag(jpeg_header(4000, 3000), None), cv2.IMREAD_COLOR)
+
+
+@override_settings(CARD_CACHE_ENABLED=True, CARD_CACHE_MEMORY_SIZE=2, CARD_CACHE_TTL=3600)
+class CardCacheTests(TestCase):
+    IMAGES = {'imageFront': EncodedImage(b'front', 'jpeg')}
+
+    def setUp(self):
+        card_cache_service._memory_cache.clear()
+        self.addCleanup(card_cache_service._memory_cache.clear)
+        self.service = CardCacheService()
+        self.user = User.objects.create(email='cache@example.com')
+
+    def put_memory(self, key, expires_in=60):
+        cached = CachedCardRead({'name': key}, self.IMAGES, time.time() + expires_in)
+        self.service._CardCacheService__put_memory(key, cached)
+
+    def get_memory(self, key):
+        return self.service._CardCacheService__get_memory(key)
+
+    def store(self, key):
+        # close_old_connections() would end the test transaction
+        with mock.patch.object(card_cache_service, 'close_old_connections'):
+            self.service._CardCacheService__store(key, 'healthcard', {'name': key}, self.IMAGES)
+
+    def test_memory_tier_evicts_the_least_recently_used_entry(self):
+        self.put_memory('a')
+        self.put_memory('b')
+        self.get_memory('a')
+        self.put_memory('c')
+
+        self.assertEqual(list(card_cache_service._memory_cache), ['a', 'c'])
+        self.assertIsNone(self.get_memory('b'))
+
+    def test_memory_tier_drops_expired_entries(self):
+        self.put_memory('a', expires_in=-1)
+
+        self.assertIsNone(self.get_memory('a'))
+        self.assertNotIn('a', card_cache_service._memory_cache)
+
+    def test_database_tier_hit_fills_the_memory_tier(self):
+        self.store('key-1')
+        card_cache_service._memory_cache.clear()
+
+        card, images = self.service.get_card('key-1', HealthCareCard, self.user)
+
+        self.assertIsInstance(card, HealthCareCard)
+        self.assertEqual((card.name, card.user), ('key-1', self.user))
+        self.assertEqual((images['imageFront'].data, images['imageFront'].ext), (b'front', 'jpeg'))
+        self.assertIsNotNone(self.get_memory('key-1'))
+
+    def test_storing_purges_expired_rows(self):
+        self.store('old')
+        CardReadCache.objects.filter(key='old').update(expiresAt=timezone.now() - timedelta(seconds=1))
+        card_cache_service._memory_cache.clear()
+
+        self.assertIsNone(self.service.get_card('old', HealthCareCard, self.user))
+        self.store('new')
+        self.assertEqual(list(CardReadCache.objects.values_list('key', flat=True)), ['new'])
+
+    @override_settings(CARD_CACHE_ENABLED=False)
+    def test_disabled_cache_does_not_read_the_upload(self):
+        upload = mock.Mock()
+
+        self.assertIsNone(self.service.key('healthcard', upload))
+        upload.chunks.assert_not_called()
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsAccessTests(SimpleTestCase):
+    def get(self, **headers):
+        with mock.patch('cardreader.api.views.registry') as registry:
+            registry.render.return_value = 'card_reads_total 1\n'
+            return metrics_view(APIRequestFactory().get('/api/metrics/', **headers))
+
+    def test_requires_the_scrape_token(self):
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer scrape-token').status_code, 200)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer other-token').status_code, 403)
+        self.assertEqual(self.get(REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_is_closed_without_a_configured_token(self):
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+calls = []
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@idempotent
+def counting_view(request):
+    calls.append(request.path)
+    if request.data.get('fail'):
+        return Response({'error': 'failed'}, status=500)
+    return Response({'call': len(calls)}, status=201)
+
+
+class IdempotencyTests(TestCase):
+    PATH = '/api/idcard/base64/'
+
+    def setUp(self):
+        calls.clear()
+        self.factory = APIRequestFactory()
+
+    def post(self, key='key-1', path=PATH, **data):
+        return counting_view(self.factory.post(path, data, format='json', HTTP_IDEMPOTENCY_KEY=key))
+
+    @staticmethod
+    def scope():
+        # Anonymous requests without an API key
+        return 'key:' + hashlib.sha256(b'').hexdigest()
+
+    def test_replays_the_stored_response(self):
+        first, second = self.post(), self.post()
+
+        self.assertEqual((first.status_code, first.data), (201, {'call': 1}))
+        self.assertEqual((second.status_code, second.data), (201, {'call': 1}))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(calls), 1)
+
+    def test_rejects_a_key_reused_on_another_endpoint(self):
+        self.post()
+
+        self.assertEqual(self.post(path='/api/healthcard/base64/').status_code, 422)
+
+    def test_server_errors_are_not_remembered(self):
+        self.post(fail=True)
+
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        self.assertEqual(self.post().status_code, 201)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_answers_409_while_the_first_request_runs(self):
+        IdempotencyRecord.objects.create(scope=self.scope(), key='key-1', requestPath=self.PATH)
+
+        self.assertEqual(self.post().status_code, 409)
+        self.assertEqual(calls, [])
+
+    def test_retry_reserves_a_released_key_before_running(self):
+        IdempotencyRecord.objects.create(scope=self.scope(), key='key-1', requestPath=self.PATH)
+
+        def release(record, deadline):
+            record.delete()
+            return None
+
+        with mock.patch.object(idempotency, '_wait_for_completion', side_effect=release):
+            response = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get(key='key-1').status, 'completed')
+
+    @override_settings(IDEMPOTENCY_LEASE=60, IDEMPOTENCY_RETENTION=3600)
+    def test_releases_abandoned_reservations_and_purges_expired_rows(self):
+        IdempotencyRecord.objects.create(scope=self.scope(), key='key-1', requestPath=self.PATH)
+        IdempotencyRecord.objects.create(scope='user:1', key='old', requestPath=self.PATH, status='completed')
+        IdempotencyRecord.objects.create(scope='user:1', key='recent', requestPath=self.PATH, status='completed')
+        IdempotencyRecord.objects.filter(key='key-1').update(createdAt=timezone.now() - timedelta(seconds=120))
+        IdempotencyRecord.objects.filter(key='old').update(createdAt=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(sorted(IdempotencyRecord.objects.values_list('key', flat=True)), ['key-1', 'recent'])
+
+
+class EasyOcrRecognizeTests(SimpleTestCase):
+    def test_recognizes_all_lines_in_one_call_and_maps_them_back(self):
+        reader = SimpleNamespace(character='0123456789', lang_char='0123456789', recognizer=None, converter=None,
+                                 device='cpu')
+        images = [blank(30, 100)[:, :, 0], blank(40, 200), blank(30, 150)]
+
+        def get_text(character, imgH, imgW, recognizer, converter, image_list, **options):
+            texts = ['111', '', '333']
+            return [(box, texts[i], 0.9) for i, (box, _) in enumerate(image_list)]
+
+        with mock.patch('easyocr.recognition.get_text', side_effect=get_text) as recognize:
+            results = EasyOcrEngine._EasyOcrEngine__recognize(reader, images, None, 1)
+
+        recognize.assert_called_once()
+        self.assertEqual(recognize.call_args.kwargs['batch_size'], 3)
+        self.assertEqual(results[0], [([[0, 0], [100, 0], [100, 30], [0, 30]], '111', 0.9)])
+        self.assertEqual(results[1], [])
+        self.assertEqual(results[2], [([[0, 0], [150, 0], [150, 30], [0, 30]], '333', 0.9)])
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_merges_concurrent_requests_and_slices_the_results(self):
+        batches = []
+        gate = threading.Event()
+
+        def run_batch(key, images):
+            gate.wait(1)
+            batches.append((key, images))
+            return [f'{key}{image}' for image in images]
+
+        batcher = MicroBatcher(run_batch, max_items=10, max_wait=0.2)
+        first, second, third = batcher.submit('a', [1, 2]), batcher.submit('a', [3]), batcher.submit('b', [4])
+        gate.set()
+
+        self.assertEqual(first.result(1), (['a1', 'a2'], 3))
+        self.assertEqual(second.result(1), (['a3'], 3))
+        self.assertEqual(third.result(1), (['b4'], 1))
+        self.assertEqual(sorted(batches), [('a', [1, 2, 3]), ('b', [4])])
+
+    def test_stops_collecting_at_max_items(self):
+        batcher = MicroBatcher(lambda key, images: images, max_items=2, max_wait=0.2)
+        first, second = batcher.submit('a', [1, 2]), batcher.submit('a', [3])
+
+        self.assertEqual(first.result(1), ([1, 2], 2))
+        self.assertEqual(second.result(1), ([3], 1))
+
+    def test_failures_reach_every_caller_of_the_batch(self):
+        def run_batch(key, images):
+            raise RuntimeError('inference failed')
+
+        future = MicroBatcher(run_batch, max_items=4, max_wait=0).submit('a', [1])
+
+        self.assertIsInstance(future.exception(1), RuntimeError)
+
+    def test_releases_the_batch_after_running_it(self):
+        released = threading.Event()
+        batcher = MicroBatcher(lambda key, images: images, max_items=4, max_wait=0)
+
+        class Image:
+            def __del__(self):
+                released.set()
+
+        future = batcher.submit('a', [Image()])
+        future.result(1)
+        del future
+
+        # The dispatcher blocks in get() again, with no reference left to the served images
+        self.assertTrue(released.wait(1))
+
+
+class PreprocessVariantsTests(SimpleTestCase):
+    def test_variants_match_cv2_threshold(self):
+        image = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+        tresholds = [0, 80, 100, 127.5, 200, 255]
+        service = ImageProcessingService()
+
+        variants = service.preprocess_image_variants(image, 5, tresholds)
+
+        self.assertEqual((variants.shape, variants.dtype), ((len(tresholds), 80, 120), np.uint8))
+        for treshold, variant in zip(tresholds, variants):
+            np.testing.assert_array_equal(variant, service.preprocess_image(image, 5, treshold))
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'cardreader.api.middleware.RequestTracingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -197,3 +199,146 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'cardreader.User'
 
 CORS_ORIGIN_ALLOW_ALL = True
+
+# OCR pipeline
+OCR_READER_POOL_SIZE = int(env('OCR_READER_POOL_SIZE', '1'))
+# Opt-in for nodes with CUDA, the readers cannot be preloaded before forking then
+OCR_USE_GPU = env('OCR_USE_GPU', 'false').lower() == 'true'
+OCR_READER_CHECKOUT_TIMEOUT = float(env('OCR_READER_CHECKOUT_TIMEOUT', '60'))
+OCR_RECOGNIZER_ONLY_ROIS = env('OCR_RECOGNIZER_ONLY_ROIS', 'true').lower() == 'true'
+# Card localization engines tried in order, the last one is the fallback
+CARD_LOCALIZATION_ENGINES = env('CARD_LOCALIZATION_ENGINES', 'contour,rembg').split(',')
+CARD_LOCALIZATION_MIN_CONFIDENCE = float(env('CARD_LOCALIZATION_MIN_CONFIDENCE', '0.8'))
+# Longest side of the downscaled proxy image rembg segments instead of the full photo
+CARD_SEGMENTATION_MAX_SIDE = int(env('CARD_SEGMENTATION_MAX_SIDE', '640'))
+# Longest side uploads are downscaled to while decoding, a few times the canonical card width
+CARD_DECODE_MAX_SIDES = {
+    'idcard': 2400,
+    'studentcard': 2400,
+    'healthcard': 2000,
+}
+# Width in pixels every card is rectified to before its fields are cropped, height follows the ID-1 ratio
+CARD_CANONICAL_WIDTHS = {
+    'idcard': 1200,
+    'studentcard': 1200,
+    'healthcard': 1000,
+}
+# 'batch' reads every binarization threshold at once and keeps the most confident parse,
+# 'sequential' tries the thresholds one by one until a value parses
+THRESHOLD_SWEEP_MODE = env('THRESHOLD_SWEEP_MODE', 'batch')
+# Threads shared by all requests for processing the two sides of a card at the same time
+CARD_SIDE_WORKERS = int(env('CARD_SIDE_WORKERS', '4'))
+
+# Card ingestion jobs
+CARD_JOB_WORKERS = int(env('CARD_JOB_WORKERS', '2'))
+CARD_JOB_POLL_INTERVAL = float(env('CARD_JOB_POLL_INTERVAL', '1'))
+CARD_JOB_STALE_AFTER = int(env('CARD_JOB_STALE_AFTER', '600'))
+
+# Cache of fields extracted from identical uploads
+CARD_CACHE_ENABLED = env('CARD_CACHE_ENABLED', 'true').lower() == 'true'
+CARD_CACHE_MEMORY_SIZE = int(env('CARD_CACHE_MEMORY_SIZE', '128'))
+CARD_CACHE_TTL = int(env('CARD_CACHE_TTL', '86400'))
+
+# Idempotency-Key handling on the card ingestion endpoints
+IDEMPOTENCY_RETENTION = int(env('IDEMPOTENCY_RETENTION', '86400'))
+IDEMPOTENCY_WAIT_TIMEOUT = float(env('IDEMPOTENCY_WAIT_TIMEOUT', '5'))
+# Seconds after which a key whose request never answered is released, longer than GUNICORN_TIMEOUT
+IDEMPOTENCY_LEASE = int(env('IDEMPOTENCY_LEASE', '300'))
+
+# Stored card images, written by background threads after the card is committed
+CARD_IMAGE_FORMAT = env('CARD_IMAGE_FORMAT', 'webp')
+CARD_IMAGE_QUALITY = int(env('CARD_IMAGE_QUALITY', '80'))
+# Longest side of the stored card images, the only copy kept, 0 keeps the rectified resolution
+CARD_IMAGE_MAX_SIDE = int(env('CARD_IMAGE_MAX_SIDE', '0'))
+CARD_IMAGE_WRITERS = int(env('CARD_IMAGE_WRITERS', '2'))
+
+# Card upload requests larger than this are spooled to a temporary file and decoded from a memory map
+CARD_UPLOAD_MEMORY_LIMIT = int(env('CARD_UPLOAD_MEMORY_LIMIT', str(1024 * 1024)))
+
+# Every process of the host writes its metrics snapshot here, the metrics endpoint reports the sum of all of them
+METRICS_DIR = env('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'cardreader-metrics'))
+# Bearer token the metrics endpoint requires, the endpoint is closed while it is empty
+METRICS_TOKEN = env('METRICS_TOKEN', '')
+
+# Spans are appended to this file when set, otherwise written to stderr
+TRACING_FILE = env('TRACING_FILE', '')
+# Request tracing, every finished span is logged as one JSON line. On by default only with a trace file,
+# writing every span to stderr would block the request threads on the console
+TRACING_ENABLED = env('TRACING_ENABLED', 'true' if TRACING_FILE else 'false').lower() == 'true'
+# Adds the recognized text to the OCR spans, it contains personal data
+TRACING_INCLUDE_TEXT = env('TRACING_INCLUDE_TEXT', 'false').lower() == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'tracing': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': TRACING_FILE,
+            'formatter': 'message',
+        } if TRACING_FILE else {
+            'class': 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'cardreader.tracing': {
+            'handlers': ['tracing'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Debug artifacts: ROI crops and OCR overlays of a sampled fraction of requests, 0 turns them off
+DEBUG_ARTIFACTS_RATE = float(env('DEBUG_ARTIFACTS_RATE', '0'))
+DEBUG_ARTIFACTS_DIR = env('DEBUG_ARTIFACTS_DIR', os.path.join(tempfile.gettempdir(), 'cardreader-debug'))
+# The oldest artifacts are deleted beyond this many files
+DEBUG_ARTIFACTS_MAX_FILES = int(env('DEBUG_ARTIFACTS_MAX_FILES', '1000'))
+# Artifacts waiting to be written, further ones are dropped
+DEBUG_ARTIFACTS_QUEUE_SIZE = int(env('DEBUG_ARTIFACTS_QUEUE_SIZE', '64'))
+
+# Models loaded before gunicorn or process_card_jobs fork their workers: 'ocr', 'rembg'.
+# Preloading 'rembg' is only fork-safe with OMP_NUM_THREADS=1, which keeps onnxruntime from starting thread pools
+PRELOAD_MODELS = [model for model in env('PRELOAD_MODELS', 'ocr').split(',') if model]
+# Torch intra-op threads of each forked worker, 0 keeps torch's default
+OCR_TORCH_THREADS = int(env('OCR_TORCH_THREADS', '0'))
+
+# Local OCR server: run_ocr_server worker processes that OcrReader sends its reads to
+OCR_SERVER_ENABLED = env('OCR_SERVER_ENABLED', 'false').lower() == 'true'
+OCR_SERVER_ADDRESS = env('OCR_SERVER_ADDRESS', os.path.join(tempfile.gettempdir(), 'cardreader-ocr.sock'))
+OCR_SERVER_AUTHKEY = env('OCR_SERVER_AUTHKEY', SECRET_KEY)
+OCR_SERVER_TIMEOUT = float(env('OCR_SERVER_TIMEOUT', '60'))
+OCR_SERVER_WORKERS = int(env('OCR_SERVER_WORKERS', '2'))
+# Torch intra-op threads of each OCR server worker, every worker is pinned to this many cores of its own
+OCR_SERVER_THREADS = int(env('OCR_SERVER_THREADS', '2'))
+# Requests each OCR server worker handles at the same time, their reads are batched together
+OCR_SERVER_CONNECTIONS = int(env('OCR_SERVER_CONNECTIONS', '4'))
+
+# Recognizer-only reads of concurrent requests are merged into one inference call for at most
+# this many milliseconds or this many images, 0 runs every read on its own
+OCR_BATCH_MAX_WAIT_MS = float(env('OCR_BATCH_MAX_WAIT_MS', '5'))
+OCR_BATCH_MAX_ITEMS = int(env('OCR_BATCH_MAX_ITEMS', '32'))
+
+# OCR inference backend: 'torch' runs easyocr's networks, 'onnx' the models written by export_onnx_models
+OCR_BACKEND = env('OCR_BACKEND', 'torch')
+OCR_ONNX_DIR = env('OCR_ONNX_DIR', str(BASE_DIR / 'models' / 'onnx'))
+OCR_ONNX_QUANTIZED = env('OCR_ONNX_QUANTIZED', 'true').lower() == 'true'
+# onnxruntime thread pools of each session, 0 lets onnxruntime use every physical core.
+# run_ocr_server workers use OCR_SERVER_THREADS intra-op threads instead
+OCR_ONNX_INTRA_THREADS = int(env('OCR_ONNX_INTRA_THREADS', '0'))
+OCR_ONNX_INTER_THREADS = int(env('OCR_ONNX_INTER_THREADS', '1'))
+
+# OCR engine of each kind of field: 'easyocr', 'tesseract' or 'stub'
+OCR_FIELD_ENGINES = {
+    'text': env('OCR_TEXT_ENGINE', 'easyocr'),
+    'numeric': env('OCR_NUMERIC_ENGINE', 'easyocr'),
+    'mrz': env('OCR_MRZ_ENGINE', 'easyocr'),
+}
+OCR_TESSERACT_COMMAND = env('OCR_TESSERACT_COMMAND', 'tesseract')
+# Trained data the tesseract engine reads with, e.g. 'hun+eng'
+OCR_TESSERACT_LANGUAGES = env('OCR_TESSERACT_LANGUAGES', 'hun')
+OCR_TESSERACT_TIMEOUT = float(env('OCR_TESSERACT_TIMEOUT', '30'))
@@ -0,0 +1,31 @@
+import os
+
+wsgi_app = 'djangoProject.wsgi:application'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# The application, and with it the models, is loaded once in the master and shared with the forked workers
+preload_app = True
+
+
+def on_starting(server):
+    # Snapshots left behind by the processes of an earlier run
+    from cardreader.services.metrics_service import registry
+    registry.remove_dead()
+
+
+def when_ready(server):
+    # Runs in the master after the application is loaded and before any worker is forked
+    from cardreader.services.preload_service import preload_models
+    preload_models()
+
+
+def post_fork(server, worker):
+    from cardreader.services.preload_service import after_fork
+    after_fork()
+
+
+def child_exit(server, worker):
+    # Also runs for workers that were killed and could not clean up after themselves
+    from cardreader.services.metrics_service import registry
+    registry.remove(worker.pid)